@@ -0,0 +1,74 @@
+# Benchmark for the memory of ColumnarInfo compared to a list of lists.
+#
+# Builds sections of 200k rows shaped like real agent output: lnx_if with
+# unique counters per row, ps with random PIDs and sizes and a few hundred
+# distinct command lines, and df with a small set of repeated filesystems.
+# Prints the memory retained and the time to parse each with
+# parse_agent_output, as lists and as ColumnarInfo.
+#
+#     python benchmarks/bench_columnar.py
+
+import random
+import time
+import tracemalloc
+
+from pytest_check_mk import parser
+
+
+ROWS = 200000
+
+
+def lnx_if(rows):
+    lines = ['<<<lnx_if>>>']
+    for i in range(rows):
+        lines.append('eth{} {} {} 0 0 0 0 0 {} {} {} 0 0 0 0 0 0'.format(
+            i % 64, random.randrange(10 ** 12), random.randrange(10 ** 9), random.randrange(10 ** 6),
+            random.randrange(10 ** 12), random.randrange(10 ** 9)))
+    return '\n'.join(lines) + '\n'
+
+
+def ps(rows):
+    users = ['root', 'www-data', 'postgres', 'nobody', 'daemon']
+    commands = ['/usr/sbin/daemon{} --config /etc/daemon{}.conf --verbose'.format(i, i % 7) for i in range(300)]
+    lines = ['<<<ps>>>']
+    for _ in range(rows):
+        lines.append('({},{},{},00:00:{:02d}/{:02d}:{:02d}:{:02d},{}) {}'.format(
+            random.choice(users), random.randrange(10 ** 7), random.randrange(10 ** 6), random.randrange(60),
+            random.randrange(24), random.randrange(60), random.randrange(60), random.randrange(4 * 10 ** 6),
+            random.choice(commands)))
+    return '\n'.join(lines) + '\n'
+
+
+def df(rows):
+    lines = ['<<<df>>>']
+    for i in range(rows):
+        lines.append('/dev/sda{0} ext4 103081248 {1} {2} {3}% /mnt/disk{0}'.format(
+            i % 500, 40000000 + i % 1000, 60000000 - i % 1000, 40 + i % 50))
+    return '\n'.join(lines) + '\n'
+
+
+def measure(name, output, columnar):
+    tracemalloc.start()
+    try:
+        start = time.time()
+        index = parser.parse_agent_output(output, columnar=columnar)
+        elapsed = time.time() - start
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(index[name].info) == ROWS
+    return retained, peak, elapsed
+
+
+def main():
+    random.seed(0)
+    for name, generate in [('lnx_if', lnx_if), ('ps', ps), ('df', df)]:
+        output = generate(ROWS)
+        for columnar in (False, True):
+            retained, peak, elapsed = measure(name, output, columnar)
+            print('{:8} {:9} {:7.1f} MiB retained {:7.1f} MiB peak {:6.2f} s'.format(
+                name, 'columnar' if columnar else 'lists', retained / 2.0 ** 20, peak / 2.0 ** 20, elapsed))
+
+
+if __name__ == '__main__':
+    main()
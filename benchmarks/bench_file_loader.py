@@ -0,0 +1,32 @@
+# Micro-benchmark for setting up the namespace of a check module.
+#
+# Compares executing the header source for every module (as check modules were
+# set up before) with copying the precompiled header template.
+#
+#     python benchmarks/bench_file_loader.py
+
+import timeit
+
+from pytest_check_mk import file_loader
+
+
+_LEGACY_HEADER = file_loader._HEADER + ''.join(
+    '{} = {}()\n'.format(name, factory.__name__) for name, factory in file_loader._REGISTRIES)
+
+
+def legacy_namespace():
+    namespace = {}
+    exec(_LEGACY_HEADER, namespace)
+    return namespace
+
+
+def main(number=20000):
+    file_loader.new_check_namespace()
+
+    for label, func in [('exec header', legacy_namespace), ('header template', file_loader.new_check_namespace)]:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('{:<16} {:8.2f} us/load'.format(label, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
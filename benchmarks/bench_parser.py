@@ -0,0 +1,65 @@
+# Benchmark for parsing a large section of agent output.
+#
+# Compares the line scanner as it was before (stripping every line several
+# times to look for headers) with parse_info and parse_agent_output on a
+# section of one million lines, with and without a separator.
+#
+#     python benchmarks/bench_parser.py
+
+import re
+import timeit
+
+from pytest_check_mk import parser
+
+
+def legacy_parse_info(check_output):
+    lines = check_output.splitlines(True)
+    name, options = legacy_parse_header(lines[0].strip())
+    try:
+        separator = chr(int(options['sep']))
+    except KeyError:
+        separator = None
+    nostrip = 'nostrip' in options
+
+    output = []
+    for line in lines[1:]:
+        if legacy_is_header(line.strip()):
+            raise ValueError(line)
+        if not nostrip:
+            line = line.strip()
+        output.append(line.split(separator))
+    return name, output
+
+
+def legacy_parse_header(header):
+    header_items = header[3:-3].split(':')
+    options = {}
+    for option in header_items[1:]:
+        key, value = re.match(r'^([^\(]+)(?:\((.*)\))$', option).groups()
+        options[key] = value
+    return header_items[0], options
+
+
+def legacy_is_header(line):
+    return line.strip()[:3] == '<<<' and line.strip()[-3:] == '>>>'
+
+
+def section(header, line, lines):
+    return header + '\n' + '\n'.join([line] * lines) + '\n'
+
+
+def main(lines=1000000):
+    outputs = [
+        ('whitespace', section('<<<df>>>', '/dev/sda1 ext4 41152736 9375308 29664252 25% /', lines)),
+        ('sep(59)', section('<<<mssql:sep(59)>>>', 'MSSQLSERVER;10.50.1600.1;RTM;Standard Edition', lines)),
+    ]
+    for label, output in outputs:
+        for implementation, func in [('legacy', legacy_parse_info),
+                                     ('parse_info', parser._parse_info),
+                                     ('parse_agent_output', parser.parse_agent_output)]:
+            best = min(timeit.repeat(lambda: func(output), number=1, repeat=3))
+            print('{:<12} {:<20} {:8.2f} s {:8.1f} ns/line'.format(label, implementation, best, best / lines * 1e9))
+
+
+if __name__ == '__main__':
+    main()
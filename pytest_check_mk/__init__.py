@@ -1,6 +1,21 @@
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+import sys
+
+
+# The package is imported by every pytest run via the plugin entry point, and
+# the version takes a call of git in a source checkout, so it is only looked
+# up on first access (module __getattr__ needs Python 3.7)
+def __getattr__(name):
+    if name == '__version__':
+        from ._version import get_versions
+        version = globals()['__version__'] = get_versions()['version']
+        return version
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    from ._version import get_versions
+    __version__ = get_versions()['version']
+    del get_versions
 
 
 OK = 0
@@ -14,3 +29,19 @@ class MissingFileError(Exception):
     def __init__(self, path):
         message = 'Required file "{}" does not exist.'.format(path)
         super(MissingFileError, self).__init__(message)
+
+
+class BudgetExceeded(BaseException):
+    # Not an Exception, so that "except Exception" in check code does not
+    # swallow it
+
+    def __init__(self, kind, limit, stack):
+        message = 'Check exceeded its {} budget of {}s, stopped at:\n{}'.format(kind, limit, stack)
+        super(BudgetExceeded, self).__init__(message)
+        self.kind = kind
+        self.limit = limit
+        self.stack = stack
+
+    def __reduce__(self):
+        # Raised in isolated worker processes and passed back pickled
+        return BudgetExceeded, (self.kind, self.limit, self.stack)
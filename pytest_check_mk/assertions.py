@@ -51,3 +51,21 @@ def assert_well_formed_perfdata_entry(entry):
     assert type(entry[1]) in (int, float)
     for value in entry[2:]:
         assert (type(value) in (int, float)) or value == ''
+
+
+def assert_memory_below(function, args, peak=None, retained=None, sites=10):
+    __tracebackhide__ = True
+    from pytest_check_mk.memory import measure_memory, peak_allocation_sites
+
+    usage = measure_memory(function, *args)
+    exceeded = []
+    if peak is not None and usage.peak > peak:
+        exceeded.append('peak memory {} bytes exceeds {} bytes'.format(usage.peak, peak))
+    if retained is not None and usage.retained > retained:
+        exceeded.append('retained memory {} bytes exceeds {} bytes'.format(usage.retained, retained))
+
+    if exceeded:
+        lines = exceeded + ['Top allocation sites at the peak:']
+        lines.extend('    {}'.format(statistic) for statistic in peak_allocation_sites(function, *args)[:sites])
+        raise AssertionError('\n'.join(lines))
+    return usage
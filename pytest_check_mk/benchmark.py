@@ -0,0 +1,148 @@
+import collections
+import gc
+import math
+import time
+
+import pytest
+
+from pytest_check_mk.budget import _consume
+
+
+CACHE_KEY = 'check_mk/benchmarks'
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Time per call in nanoseconds over all rounds, each round making calls calls
+Timing = collections.namedtuple('Timing', ['median_ns', 'p95_ns', 'rounds', 'calls'])
+
+
+class BenchmarkResult(object):
+
+    def __init__(self, key, parse, call, baseline=None):
+        self.key = key
+        # Timings of parsing the output and of the inventory or check function
+        self.parse = parse
+        self.call = call
+        # Median ns per call of parse and call stored by an earlier run, if any
+        self.baseline = baseline
+
+    def ratios(self):
+        # Current median time relative to the baseline, by phase
+        if not self.baseline:
+            return {}
+        return dict((phase, getattr(self, phase).median_ns / self.baseline[phase])
+                    for phase in ('parse', 'call') if self.baseline.get(phase))
+
+    def summary_line(self):
+        line = '{}: parse {:.0f} ns (p95 {:.0f} ns), call {:.0f} ns (p95 {:.0f} ns)'.format(
+            self.key, self.parse.median_ns, self.parse.p95_ns, self.call.median_ns, self.call.p95_ns)
+        ratios = self.ratios()
+        if ratios:
+            line += ', ' + ', '.join('{} {:.2f}x baseline'.format(phase, ratios[phase]) for phase in sorted(ratios))
+        return line
+
+
+class CheckBenchmark(object):
+    # Times inventory and check functions of a CheckWrapper in calibrated
+    # rounds, separately from parsing their output. The median times are
+    # compared to baselines from earlier runs in the pytest cache.
+
+    def __init__(self, nodeid, cache=None, threshold=2.0, update=False, rounds=20, min_round_time=0.01):
+        self.nodeid = nodeid
+        self.cache = cache
+        self.threshold = threshold
+        self.update = update
+        self.rounds = rounds
+        self.min_round_time = min_round_time
+        self.results = []
+        # Number of measurements by key, repeated measurements of a test get
+        # keys of their own
+        self._key_counts = collections.Counter()
+
+    def check(self, check, item, params, check_output, label=None):
+        __tracebackhide__ = True
+        return self._run(check, 'check', check_output, lambda parsed: check.check_parsed(item, params, parsed), label)
+
+    def inventory(self, check, check_output, label=None):
+        __tracebackhide__ = True
+        return self._run(check, 'inventory', check_output, lambda parsed: _consume(check.inventory_parsed(parsed)),
+                         label)
+
+    def _run(self, check, kind, check_output, call, label):
+        __tracebackhide__ = True
+        key = self._unique_key('{}::{}::{}'.format(label or self.nodeid, check.name, kind), label)
+        parsed = check.parse(check_output)
+        parse_timing = self.measure(lambda: check.parse(check_output))
+        # Like in Check_MK, every call gets the same result of the parse function
+        # or its own copy of the info, which is made before the timer starts
+        call_timing = self.measure(call, prepare=lambda: check.copy_parsed(parsed))
+
+        result = BenchmarkResult(key, parse_timing, call_timing, self._baselines().get(key))
+        self.results.append(result)
+
+        regressions = [(phase, ratio) for phase, ratio in sorted(result.ratios().items()) if ratio > self.threshold]
+        if regressions and not self.update:
+            pytest.fail('{}: {} regressed by more than {}x compared to the baseline'.format(
+                key, ', '.join('{} {:.2f}x'.format(phase, ratio) for phase, ratio in regressions), self.threshold))
+
+        if result.baseline is None or self.update:
+            self._store_baseline(key, result)
+        return result
+
+    def _unique_key(self, key, label):
+        __tracebackhide__ = True
+        self._key_counts[key] += 1
+        count = self._key_counts[key]
+        if count == 1:
+            return key
+        if label is not None:
+            raise pytest.UsageError('check_benchmark label {!r} is used more than once for {}'.format(label, key))
+        return '{}#{}'.format(key, count)
+
+    def measure(self, function, prepare=None):
+        # Times function(), or function(prepare()) with the results of prepare
+        # made before each round
+        calls = self._calibrate(function, prepare)
+        per_call = sorted(_time_calls(function, calls, prepare) / calls * 1e9 for _ in range(self.rounds))
+        median = (per_call[(len(per_call) - 1) // 2] + per_call[len(per_call) // 2]) / 2
+        p95 = per_call[int(math.ceil(0.95 * len(per_call))) - 1]
+        return Timing(median, p95, self.rounds, calls)
+
+    def _calibrate(self, function, prepare=None):
+        # Number of calls making a round take at least min_round_time
+        calls = 1
+        while True:
+            elapsed = _time_calls(function, calls, prepare)
+            if elapsed >= self.min_round_time:
+                return calls
+            calls = max(calls * 2, int(calls * self.min_round_time * 1.2 / max(elapsed, 1e-9)))
+
+    def _baselines(self):
+        if self.cache is None:
+            return {}
+        return self.cache.get(CACHE_KEY, {})
+
+    def _store_baseline(self, key, result):
+        if self.cache is None:
+            return
+        baselines = self._baselines()
+        baselines[key] = {'parse': result.parse.median_ns, 'call': result.call.median_ns}
+        self.cache.set(CACHE_KEY, baselines)
+
+
+def _time_calls(function, calls, prepare=None):
+    arguments = None if prepare is None else [prepare() for _ in range(calls)]
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = _clock()
+        if arguments is None:
+            for _ in range(calls):
+                function()
+        else:
+            for argument in arguments:
+                function(argument)
+        return _clock() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
@@ -0,0 +1,219 @@
+import math
+import os
+import pickle
+import select
+import signal
+import tempfile
+import threading
+import time
+import traceback
+import types
+
+from pytest import UsageError
+
+from pytest_check_mk import BudgetExceeded
+
+try:
+    import faulthandler
+except ImportError:  # Python 2
+    faulthandler = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+WALL = 'wall clock'
+CPU = 'CPU'
+
+# Time an isolated worker gets to report a stack dump after its wall clock
+# budget expired, before it is killed
+_KILL_DELAY = 0.5
+
+# Once a budget is exceeded, the function is interrupted again at this interval
+# until it returns, in case the check code catches the exception
+_REPEAT_INTERVAL = 0.05
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Budget(object):
+    # Wall clock and CPU time (in seconds) a check or inventory function may
+    # take. With isolated, the function runs in a forked worker process, which
+    # can also be stopped while it is stuck in C code (like a regular
+    # expression). In process, only Python code can be interrupted.
+
+    def __init__(self, wall=None, cpu=None, isolated=False):
+        self.wall = wall
+        self.cpu = cpu
+        self.isolated = isolated
+
+    def __bool__(self):
+        return self.wall is not None or self.cpu is not None
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return 'Budget(wall={!r}, cpu={!r}, isolated={!r})'.format(self.wall, self.cpu, self.isolated)
+
+    def call(self, function, *args):
+        __tracebackhide__ = True
+        if not self:
+            return function(*args)
+        if self.isolated:
+            return _call_isolated(self, function, args)
+        return _call_in_process(self, function, args)
+
+
+def _call_in_process(budget, function, args):
+    __tracebackhide__ = True
+    if not hasattr(signal, 'setitimer') or not _in_main_thread():
+        raise UsageError('Budgets can only be enforced in the main thread on Unix, use an isolated budget instead.')
+
+    timers = []
+    if budget.wall is not None:
+        timers.append((signal.ITIMER_REAL, signal.SIGALRM, WALL, budget.wall))
+    if budget.cpu is not None:
+        timers.append((signal.ITIMER_PROF, signal.SIGPROF, CPU, budget.cpu))
+
+    # Set by the signal handlers: whether the call is over, and the exception
+    # raised first when the budget was exceeded
+    state = {'done': False, 'exceeded': None}
+    previous = []
+    for timer, signum, kind, limit in timers:
+        handler = _signal_handler(kind, limit, state)
+        previous.append((timer, signum, signal.signal(signum, handler),
+                         signal.setitimer(timer, limit, _REPEAT_INTERVAL)))
+    start = _clock()
+    try:
+        result = _consume(function(*args))
+    finally:
+        state['done'] = True
+        elapsed = _clock() - start
+        for timer, signum, handler, (delay, interval) in previous:
+            signal.setitimer(timer, 0)
+            signal.signal(signum, handler)
+            if delay:
+                # Re-arm the timer of an outer budget (or other user of it)
+                signal.setitimer(timer, max(delay - elapsed, 1e-6), interval)
+
+    if state['exceeded'] is not None:
+        # The check code caught the exception (with a bare except) and returned
+        raise state['exceeded']
+    return result
+
+
+def _in_main_thread():
+    main_thread = getattr(threading, 'main_thread', None)
+    if main_thread is None:  # Python 2
+        return isinstance(threading.current_thread(), threading._MainThread)
+    return threading.current_thread() is main_thread()
+
+
+def _signal_handler(kind, limit, state):
+    def handler(signum, frame):
+        if state['done']:
+            return
+        exceeded = BudgetExceeded(kind, limit, ''.join(traceback.format_stack(frame)))
+        if state['exceeded'] is None:
+            state['exceeded'] = exceeded
+        raise exceeded
+    return handler
+
+
+def _consume(result):
+    # Generators do their work when they are iterated, so this has to happen
+    # within the budget
+    if isinstance(result, types.GeneratorType):
+        return list(result)
+    return result
+
+
+def _call_isolated(budget, function, args):
+    __tracebackhide__ = True
+    if not hasattr(os, 'fork'):
+        raise UsageError('Isolated budgets need os.fork, which is not available on this platform.')
+
+    dump = tempfile.TemporaryFile()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        _run_worker(budget, function, args, write_fd, dump)
+
+    os.close(write_fd)
+    try:
+        data, killed = _read_result(read_fd, budget.wall)
+        if killed:
+            os.kill(pid, signal.SIGKILL)
+            data = None
+        _, status = os.waitpid(pid, 0)
+    finally:
+        os.close(read_fd)
+
+    try:
+        if data:
+            success, value = pickle.loads(data)
+            if success:
+                return value
+            raise value
+
+        dump.seek(0)
+        stack = dump.read().decode('utf-8', 'replace')
+        if killed:
+            raise BudgetExceeded(WALL, budget.wall, stack)
+        if os.WIFSIGNALED(status) and os.WTERMSIG(status) == getattr(signal, 'SIGXCPU', None):
+            raise BudgetExceeded(CPU, budget.cpu, stack)
+        raise RuntimeError('Isolated worker process died with status {}\n{}'.format(status, stack))
+    finally:
+        dump.close()
+
+
+def _run_worker(budget, function, args, write_fd, dump):
+    # Runs in the forked worker process, which never returns from here
+    try:
+        if faulthandler is not None:
+            if budget.wall is not None:
+                faulthandler.dump_traceback_later(budget.wall, file=dump)
+            if budget.cpu is not None and resource is not None:
+                faulthandler.register(signal.SIGXCPU, file=dump, chain=True)
+        if budget.cpu is not None and resource is not None:
+            # Stops code stuck in C at the next full second of CPU time
+            resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+            limit = int(math.ceil(budget.cpu)) + 1
+            resource.setrlimit(resource.RLIMIT_CPU, (limit, limit + 1))
+
+        try:
+            payload = True, _call_in_process(budget, function, args)
+        except BaseException as e:
+            payload = False, e
+        if faulthandler is not None:
+            faulthandler.cancel_dump_traceback_later()
+
+        try:
+            data = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            error = RuntimeError('{} of the isolated worker could not be pickled: {!r}\n{!r}'.format(
+                'Result' if payload[0] else 'Exception', e, payload[1]))
+            data = pickle.dumps((False, error), pickle.HIGHEST_PROTOCOL)
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(data)
+    finally:
+        os._exit(0)
+
+
+def _read_result(read_fd, wall):
+    # Reads the pickled result of the worker. Returns (data, killed), killed
+    # being true if the worker had to be killed after its wall clock budget.
+    deadline = None if wall is None else _clock() + wall + _KILL_DELAY
+    chunks = []
+    while True:
+        timeout = None if deadline is None else max(deadline - _clock(), 0)
+        ready, _, _ = select.select([read_fd], [], [], timeout)
+        if not ready:
+            return b''.join(chunks), True
+        chunk = os.read(read_fd, 65536)
+        if not chunk:
+            return b''.join(chunks), False
+        chunks.append(chunk)
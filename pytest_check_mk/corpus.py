@@ -0,0 +1,150 @@
+import collections
+import multiprocessing
+import os
+import time
+import traceback
+
+from pytest_check_mk.assertions import assert_inventory_and_check_works_with_check_output
+from pytest_check_mk.file_loader import CodeCache
+from pytest_check_mk.isolation import ModulePool
+from pytest_check_mk.parser import parse_agent_output
+from pytest_check_mk.wrapper import CheckFileWrapper
+
+
+PASSED = 'passed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Outcome of one agent output of the corpus. details holds the traceback of a
+# failure or the reason for skipping.
+CorpusResult = collections.namedtuple('CorpusResult', ['path', 'outcome', 'duration', 'details'])
+
+
+class Corpus(object):
+    # Runs inventory and check of all checks of a check file against every
+    # agent output (dump) in a directory, spread over a pool of processes
+
+    def __init__(self, directory, name, processes=None, cache_directory=None):
+        self.directory = directory
+        self.name = name
+        self.path = os.path.join('checks', name)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.cache_directory = cache_directory
+        self.reports = []
+
+    def paths(self):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            paths.extend(os.path.join(dirpath, filename) for filename in filenames if not filename.startswith('.'))
+        return sorted(paths)
+
+    def run(self, check_names=None):
+        __tracebackhide__ = True
+        paths = self.paths()
+        # Compiled once into the bytecode cache here, the workers only read it
+        CodeCache(directory=self.cache_directory).load_order(self.path)
+
+        tasks = [(path, self.name, self.path, check_names, self.cache_directory) for path in paths]
+        start = _clock()
+        if self.processes == 1 or len(tasks) <= 1:
+            results = [_check_output(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                chunksize = max(1, len(tasks) // (self.processes * 8))
+                results = list(pool.imap_unordered(_check_output, tasks, chunksize))
+            finally:
+                pool.close()
+                pool.join()
+
+        report = CorpusReport(self.name, results, _clock() - start)
+        self.reports.append(report)
+        return report
+
+
+class CorpusReport(object):
+
+    def __init__(self, name, results, elapsed):
+        self.name = name
+        self.results = sorted(results, key=lambda result: result.path)
+        self.elapsed = elapsed
+
+    def _with_outcome(self, outcome):
+        return [result for result in self.results if result.outcome == outcome]
+
+    @property
+    def passed(self):
+        return self._with_outcome(PASSED)
+
+    @property
+    def failed(self):
+        return self._with_outcome(FAILED)
+
+    @property
+    def skipped(self):
+        return self._with_outcome(SKIPPED)
+
+    @property
+    def throughput(self):
+        # Agent outputs per second
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    def slowest(self, count=5):
+        return sorted(self.results, key=lambda result: result.duration, reverse=True)[:count]
+
+    def summary_lines(self, slowest=5):
+        lines = ['{}: {} outputs, {} passed, {} failed, {} skipped in {:.2f}s ({:.1f} outputs/s)'.format(
+            self.name, len(self.results), len(self.passed), len(self.failed), len(self.skipped),
+            self.elapsed, self.throughput)]
+        for result in self.failed:
+            lines.append('    FAILED {}: {}'.format(result.path, result.details.strip().splitlines()[-1]))
+        if slowest:
+            lines.append('    slowest outputs:')
+            lines.extend('    {:10.4f}s {}'.format(result.duration, result.path) for result in self.slowest(slowest))
+        return lines
+
+
+# Module pools of the worker process, by bytecode cache directory. They keep
+# the check modules executed between the agent outputs of a worker.
+_module_pools = {}
+
+
+def _check_output(task):
+    path, name, check_path, check_names, cache_directory = task
+    start = _clock()
+    try:
+        outcome, details = _check_output_with_module(path, name, check_path, check_names, cache_directory)
+    except Exception:
+        outcome, details = FAILED, traceback.format_exc()
+    return CorpusResult(path, outcome, _clock() - start, details)
+
+
+def _check_output_with_module(path, name, check_path, check_names, cache_directory):
+    if cache_directory not in _module_pools:
+        _module_pools[cache_directory] = ModulePool(CodeCache(directory=cache_directory))
+    module_pool = _module_pools[cache_directory]
+
+    module = module_pool.acquire(name, check_path)
+    try:
+        check_file = CheckFileWrapper(name, module)
+        with open(path, 'rb') as f:
+            sections = parse_agent_output(f.read())
+
+        checked = False
+        for check_name in check_names or sorted(module.check_info):
+            if check_name.split('.')[0] not in sections:
+                continue
+            try:
+                assert_inventory_and_check_works_with_check_output(check_file[check_name], sections)
+            except Exception:
+                return FAILED, '{}: {}'.format(check_name, traceback.format_exc())
+            checked = True
+    finally:
+        module_pool.release(module)
+
+    if not checked:
+        return SKIPPED, 'section {} not in agent output'.format(name)
+    return PASSED, None
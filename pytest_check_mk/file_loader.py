@@ -1,9 +1,20 @@
-import imp
+import ast
+import hashlib
+import marshal
+import multiprocessing
 import os
+import tempfile
+import types
 
 
 from pytest_check_mk import MissingFileError
 
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:  # pragma: no cover (Python 2)
+    import imp
+    MAGIC_NUMBER = imp.get_magic()
+
 
 _HEADER = '''
 import sys, os, time, socket
@@ -17,34 +28,358 @@ def regex(r):
     except Exception as e:
         raise AssertionError("Invalid regular expression '%s': %s" % (r, e))
     return rx
+'''
 
 
 # The following data structures will be filled by the checks
-check_info                         = {} # all known checks
-checkgroup_of                      = {} # groups of checks with compatible parametration
-check_includes                     = {} # library files needed by checks
-precompile_params                  = {} # optional functions for parameter precompilation, look at df for an example
-check_default_levels               = {} # dictionary-configured checks declare their default level variables here
-factory_settings                   = {} # factory settings for dictionary-configured checks
-check_config_variables             = [] # variables (names) in checks/* needed for check itself
-snmp_info                          = {} # whichs OIDs to fetch for which check (for tabular information)
-snmp_scan_functions                = {} # SNMP autodetection
-active_check_info                  = {} # definitions of active "legacy" checks
-special_agent_info                 = {}
-'''
+_REGISTRIES = [
+    ('check_info', dict),              # all known checks
+    ('checkgroup_of', dict),           # groups of checks with compatible parametration
+    ('check_includes', dict),          # library files needed by checks
+    ('precompile_params', dict),       # optional functions for parameter precompilation, look at df for an example
+    ('check_default_levels', dict),    # dictionary-configured checks declare their default level variables here
+    ('factory_settings', dict),        # factory settings for dictionary-configured checks
+    ('check_config_variables', list),  # variables (names) in checks/* needed for check itself
+    ('snmp_info', dict),               # whichs OIDs to fetch for which check (for tabular information)
+    ('snmp_scan_functions', dict),     # SNMP autodetection
+    ('active_check_info', dict),       # definitions of active "legacy" checks
+    ('special_agent_info', dict),
+]
+
+
+_header_template = None
+
+
+def new_check_namespace():
+    # The header is executed only once. Every check module starts out as a copy
+    # of the resulting namespace, with its own empty registries.
+    global _header_template
+    if _header_template is None:
+        template = {}
+        exec(_HEADER, template)
+        _header_template = template
+
+    namespace = dict(_header_template)
+    for name, factory in _REGISTRIES:
+        namespace[name] = factory()
+    return namespace
+
+
+class CodeCache(object):
+    # Keeps the compiled code of check files, so each file is compiled once per
+    # session instead of once per test. Entries are keyed by path and revalidated
+    # by mtime and size first, and by a hash of the content if those changed.
+    #
+    # If a directory is given, compiled code is additionally marshalled to disk,
+    # keyed by path, content hash and interpreter magic number, so that later
+    # runs can skip compilation entirely.
+    #
+    # Include files are cached like check files. The includes of a file are
+    # found by a static scan when it is compiled, which also makes up the
+    # dependency graph between check files and include files. The same scan
+    # provides the check names registered by a file without executing it.
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._entries = {}
+
+    def get(self, path):
+        key = os.path.abspath(path)
+        stamp = _file_stamp(key)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry.stamp == stamp:
+            return entry
+
+        with open(path, 'rb') as f:
+            source = f.read()
+        digest = hashlib.sha1(source).hexdigest()
+
+        if entry is not None and entry.digest == digest:
+            entry.stamp = stamp
+            return entry
+
+        code, metadata = self._load_or_compile(source, path, digest)
+        entry = CompiledFile(key, stamp, digest, code, metadata)
+        self._entries[key] = entry
+        return entry
+
+    def get_code(self, path):
+        return self.get(path).code
+
+    def load_order(self, path):
+        # Compiled files to execute for a check file: its includes first, in the
+        # order they are declared, and the check file itself last
+        order = []
+        self._collect_load_order(path, order, set())
+        return order
+
+    def _collect_load_order(self, path, order, seen):
+        __tracebackhide__ = True
+        key = os.path.abspath(path)
+        if key in seen:
+            return
+        seen.add(key)
+
+        if not os.path.exists(key):
+            raise MissingFileError(path)
+
+        entry = self.get(key)
+        for include_path in entry.include_paths:
+            self._collect_load_order(include_path, order, seen)
+        order.append(entry)
+
+    def dependents(self, path):
+        # Paths of all cached files including the given file, directly or indirectly
+        included_by = {}
+        for entry in self._entries.values():
+            for include_path in entry.include_paths:
+                included_by.setdefault(include_path, set()).add(entry.path)
+
+        dependents = set()
+        pending = [os.path.abspath(path)]
+        while pending:
+            for dependent in included_by.get(pending.pop(), ()):
+                if dependent not in dependents:
+                    dependents.add(dependent)
+                    pending.append(dependent)
+        return dependents
+
+    def precompile(self, paths, processes=None):
+        # Compiles the given files in a process pool and fills the cache with
+        # them. Returns a list of (path, message) tuples for files that failed to
+        # compile. Files already present in the on-disk cache are skipped.
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_precompile_file, [(path, self.directory) for path in paths])
+        finally:
+            pool.close()
+            pool.join()
+
+        errors = []
+        for path, stamp, digest, payload, error in results:
+            if error is not None:
+                errors.append((path, error))
+            elif payload is not None:
+                code, metadata = marshal.loads(payload)
+                if self.directory is not None:
+                    _write_bytecode(os.path.join(self.directory, _bytecode_key(path, digest)), (code, metadata))
+                key = os.path.abspath(path)
+                self._entries[key] = CompiledFile(key, stamp, digest, code, metadata)
+        return errors
+
+    def clear(self):
+        self._entries.clear()
+
+    def _load_or_compile(self, source, path, digest):
+        if self.directory is None:
+            return _compile(source, path)
+
+        cache_file = os.path.join(self.directory, _bytecode_key(path, digest))
+        compiled = _read_bytecode(cache_file)
+        if compiled is None:
+            compiled = _compile(source, path)
+            _write_bytecode(cache_file, compiled)
+        return compiled
+
+
+class CompiledFile(object):
+
+    def __init__(self, path, stamp, digest, code, metadata):
+        self.path = path
+        self.stamp = stamp
+        self.digest = digest
+        self.code = code
+        self.metadata = metadata
+
+    @property
+    def includes(self):
+        return self.metadata['includes']
+
+    @property
+    def check_names(self):
+        return self.metadata['check_names']
+
+    @property
+    def include_paths(self):
+        directory = os.path.dirname(self.path)
+        return [os.path.join(directory, include) for include in self.includes]
+
+
+def _precompile_file(args):
+    # Runs in the worker processes of CodeCache.precompile. Code objects cannot be
+    # pickled, so the compiled file is passed back in marshalled form.
+    path, directory = args
+    try:
+        stamp = _file_stamp(os.path.abspath(path))
+        with open(path, 'rb') as f:
+            source = f.read()
+    except (IOError, OSError) as e:
+        return path, None, None, None, str(e)
+    digest = hashlib.sha1(source).hexdigest()
+
+    if directory is not None and os.path.exists(os.path.join(directory, _bytecode_key(path, digest))):
+        return path, stamp, digest, None, None
+
+    try:
+        compiled = _compile(source, path)
+    except (SyntaxError, ValueError, TypeError) as e:
+        return path, stamp, digest, None, '{}: {}'.format(type(e).__name__, e)
+    return path, stamp, digest, marshal.dumps(compiled), None
+
+
+def find_check_files(directory='checks'):
+    # All check and include files in the checks directory, skipping hidden files
+    # and editor backups
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if not name.startswith('.') and not name.endswith('~') and
+            os.path.isfile(os.path.join(directory, name))]
+
+
+def _compile(source, path):
+    tree = ast.parse(source, path)
+    metadata = {
+        'includes': tuple(find_includes(tree)),
+        'check_names': tuple(find_check_names(tree)),
+    }
+    return compile(tree, path, 'exec'), metadata
+
+
+def find_includes(tree):
+    # Include files are declared either in check_includes or in the 'includes'
+    # key of check_info entries
+    includes = []
+
+    def add(node):
+        value = _literal(node)
+        if isinstance(value, (list, tuple)):
+            includes.extend(include for include in value if include not in includes)
+
+    for _, value in _registry_assignments(tree, 'check_includes'):
+        add(value)
+    # Only the dicts assigned to check_info, other dicts (like factory_settings)
+    # may have an 'includes' key with another meaning
+    for _, node in _registry_assignments(tree, 'check_info'):
+        if isinstance(node, ast.Dict):
+            for key, value in zip(node.keys, node.values):
+                if key is not None and _literal(key) == 'includes':
+                    add(value)
+
+    return includes
 
 
-def check_module_from_source(name, path):
+def find_check_names(tree):
+    # Names of the checks registered by literal check_info['name'] = ... assignments
+    check_names = []
+
+    for key, _ in _registry_assignments(tree, 'check_info'):
+        name = _literal(key)
+        if isinstance(name, str) and name not in check_names:
+            check_names.append(name)
+
+    return check_names
+
+
+def _registry_assignments(tree, registry):
+    # Yields the key and value nodes of all `registry[key] = value` assignments
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if (isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name) and
+                        target.value.id == registry):
+                    index = target.slice
+                    # Before Python 3.9, the index is wrapped in an ast.Index node
+                    if isinstance(index, getattr(ast, 'Index', ())):
+                        index = index.value
+                    yield index, node.value
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError):
+        return None
+
+
+def file_digest(path):
+    # Same digest as CompiledFile.digest, None for missing files
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size
+
+
+def _bytecode_key(path, digest):
+    # The filename is compiled into the code object, so it is part of the key
+    key = hashlib.sha1(MAGIC_NUMBER)
+    key.update(os.path.abspath(path).encode('utf-8'))
+    key.update(digest.encode('ascii'))
+    return key.hexdigest()
+
+
+def _read_bytecode(cache_file):
+    try:
+        with open(cache_file, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+
+    if data[:len(MAGIC_NUMBER)] != MAGIC_NUMBER:
+        return None
+    try:
+        code, metadata = marshal.loads(data[len(MAGIC_NUMBER):])
+    except (EOFError, ValueError, TypeError):
+        return None
+    return code, metadata
+
+
+def _write_bytecode(cache_file, compiled):
+    # Write to a temporary file and rename it, so concurrent runs (e.g. xdist
+    # workers) never see a partially written cache file
+    directory = os.path.dirname(cache_file)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC_NUMBER + marshal.dumps(compiled))
+        os.rename(tmp_path, cache_file)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def check_module_from_source(name, path, code_cache=None):
     __tracebackhide__ = True
 
     if not os.path.exists(path):
         raise MissingFileError(path)
 
-    source = open(path, 'r').read()
-    code = compile(source, path, 'exec')
-    module = imp.new_module(name)
+    if code_cache is None:
+        code_cache = CodeCache()
+
+    compiled_files = code_cache.load_order(path)
+    return check_module_from_code(name, compiled_files[-1].code, [f.code for f in compiled_files[:-1]])
+
+
+def check_module_from_code(name, code, include_codes=()):
+    __tracebackhide__ = True
+    module = types.ModuleType(name)
 
-    exec(_HEADER, module.__dict__)
+    module.__dict__.update(new_check_namespace())
+    for include_code in include_codes:
+        exec(include_code, module.__dict__)
     exec(code, module.__dict__)
 
     return module
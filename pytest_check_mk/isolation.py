@@ -0,0 +1,245 @@
+import os
+import re
+import sys
+import types
+
+from pytest_check_mk.file_loader import check_module_from_code
+
+
+# Values of these types cannot be changed in place, so restoring their binding
+# is enough to restore them. Functions and classes are only atomic if they were
+# not defined in the module, otherwise their state is tracked as well.
+_ATOMIC_TYPES = (
+    type(None), bool, int, float, complex, str, bytes, frozenset, type(re.compile('')),
+    type, types.ModuleType, types.FunctionType,
+)
+
+# Entries of class namespaces that are not class attributes, but descriptors
+# created for every class
+_CLASS_SLOTS = ('__dict__', '__weakref__')
+
+# Closure cells can only be written to since Python 3.7
+_WRITABLE_CELLS = sys.version_info >= (3, 7)
+
+
+class NamespaceSnapshot(object):
+    # Snapshot of a module namespace, taken after the module body was executed.
+    #
+    # Only bindings and shallow copies of the contained dicts, lists and sets are
+    # stored. On restore, rebound or deleted globals are reset and containers
+    # that were changed in place are refilled with their original items, so
+    # references to them stay valid. Nothing is copied unless it was changed.
+    #
+    # Functions and classes defined in the module have state as well: default
+    # arguments (like _seen=[]), function attributes, closure cells and class
+    # attributes. Their bindings are restored the same way and their values
+    # are tracked like the globals.
+    #
+    # Objects of other types cannot be checked for in-place changes. If the
+    # namespace holds any of them, the snapshot is not restorable and the
+    # module has to be loaded again instead.
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.restorable = True
+        self._bindings = dict(namespace)
+        self._containers = {}
+
+        for name, value in self._bindings.items():
+            # __builtins__ and friends are shared by all modules and never reset
+            if not (name.startswith('__') and name.endswith('__')):
+                self._track(value)
+
+    def _track(self, value):
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            if id(value) in self._containers:
+                continue
+
+            if isinstance(value, types.FunctionType) and value.__globals__ is self.namespace:
+                contents = _function_state(value)
+                if contents[3] and not _WRITABLE_CELLS:
+                    self.restorable = False
+                    return
+                children = [contents[0] or (), contents[1] or {}, contents[2]]
+                children.extend(cell for cell in contents[3] if cell is not _MISSING)
+            elif isinstance(value, type) and value.__module__ == self.namespace.get('__name__', _MISSING):
+                contents = _class_state(value)
+                children = list(contents.values())
+            elif isinstance(value, (staticmethod, classmethod)):
+                contents = None
+                children = [value.__func__]
+            elif isinstance(value, property):
+                contents = None
+                children = [value.fget, value.fset, value.fdel]
+            elif isinstance(value, (types.MethodType, types.BuiltinFunctionType)):
+                # Bound methods change the object they are bound to, like
+                # Cache().add or {}.setdefault. Built-in functions are bound to
+                # their module, if anything.
+                if value.__self__ is None or isinstance(value.__self__, types.ModuleType):
+                    continue
+                contents = None
+                children = [getattr(value, '__func__', None), value.__self__]
+            elif isinstance(value, _ATOMIC_TYPES):
+                continue
+            elif isinstance(value, dict):
+                contents = dict(value)
+                children = list(contents.keys()) + list(contents.values())
+            elif isinstance(value, list):
+                contents = list(value)
+                children = contents
+            elif isinstance(value, set):
+                contents = set(value)
+                children = contents
+            elif isinstance(value, tuple):
+                contents = None
+                children = value
+            else:
+                self.restorable = False
+                return
+
+            self._containers[id(value)] = (value, contents)
+            stack.extend(children)
+
+    def changed_names(self):
+        changed = set(self.namespace) ^ set(self._bindings)
+        for name, value in self._bindings.items():
+            if self.namespace.get(name, _MISSING) is not value:
+                changed.add(name)
+        return changed
+
+    def restore(self):
+        # Returns False if the namespace could not be restored safely
+        if not self.restorable:
+            return False
+
+        if self.changed_names():
+            self.namespace.clear()
+            self.namespace.update(self._bindings)
+
+        for container, contents in self._containers.values():
+            if contents is not None and _changed_in_place(container, contents):
+                _refill(container, contents)
+
+        return True
+
+
+_MISSING = object()
+
+
+def _function_state(function):
+    cells = []
+    for cell in function.__closure__ or ():
+        try:
+            cells.append(cell.cell_contents)
+        except ValueError:  # the variable is not bound yet
+            cells.append(_MISSING)
+    return (function.__defaults__, getattr(function, '__kwdefaults__', None), function.__dict__, cells)
+
+
+def _class_state(cls):
+    return dict((name, value) for name, value in vars(cls).items() if name not in _CLASS_SLOTS)
+
+
+def _changed_in_place(container, contents):
+    if isinstance(container, types.FunctionType):
+        state = _function_state(container)
+        return any(a is not b for a, b in zip(state[:3], contents[:3])) or _changed_in_place(state[3], contents[3])
+    if isinstance(container, type):
+        return _changed_in_place(_class_state(container), contents)
+    if len(container) != len(contents):
+        return True
+    if isinstance(container, dict):
+        return any(contents.get(key, _MISSING) is not value for key, value in container.items())
+    if isinstance(container, list):
+        return any(a is not b for a, b in zip(container, contents))
+    return container != contents
+
+
+def _refill(container, contents):
+    if isinstance(container, types.FunctionType):
+        defaults, kwdefaults, function_dict, cells = contents
+        container.__defaults__ = defaults
+        if kwdefaults is not None or getattr(container, '__kwdefaults__', None) is not None:
+            container.__kwdefaults__ = kwdefaults
+        container.__dict__ = function_dict
+        for cell, value in zip(container.__closure__ or (), cells):
+            if value is _MISSING:
+                try:
+                    del cell.cell_contents
+                except ValueError:
+                    pass
+            else:
+                cell.cell_contents = value
+    elif isinstance(container, type):
+        for name in set(_class_state(container)) - set(contents):
+            delattr(container, name)
+        for name, value in contents.items():
+            if vars(container).get(name, _MISSING) is not value:
+                setattr(container, name, value)
+    elif isinstance(container, list):
+        container[:] = contents
+    else:
+        container.clear()
+        container.update(contents)
+
+
+class ModulePool(object):
+    # Keeps executed check modules between tests. A module is handed out by
+    # acquire() and reset to its state right after execution by release(), so
+    # the module body only has to be executed again if the check file or one
+    # of its includes changed, or if its state could not be restored.
+
+    def __init__(self, code_cache):
+        self.code_cache = code_cache
+        self._entries = {}
+
+    def acquire(self, name, path):
+        __tracebackhide__ = True
+        key = (name, os.path.abspath(path))
+        codes = [compiled_file.code for compiled_file in self.code_cache.load_order(path)]
+
+        entry = self._entries.get(key)
+        if entry is not None and not entry.in_use and _same_objects(entry.codes, codes):
+            entry.in_use = True
+            return entry.module
+
+        module = check_module_from_code(name, codes[-1], codes[:-1])
+        if entry is None or not entry.in_use:
+            self._entries.pop(key, None)
+            snapshot = NamespaceSnapshot(module.__dict__)
+            if snapshot.restorable:
+                self._entries[key] = _PoolEntry(module, codes, snapshot)
+        return module
+
+    def release(self, module):
+        for key, entry in list(self._entries.items()):
+            if entry.module is module:
+                entry.in_use = False
+                if not entry.snapshot.restore():
+                    del self._entries[key]
+
+    def invalidate(self, path):
+        # Drop the modules of a changed file and of all check files including it
+        paths = self.code_cache.dependents(path)
+        paths.add(os.path.abspath(path))
+        for key, entry in list(self._entries.items()):
+            if key[1] in paths and not entry.in_use:
+                del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+
+def _same_objects(first, second):
+    return len(first) == len(second) and all(a is b for a, b in zip(first, second))
+
+
+class _PoolEntry(object):
+
+    def __init__(self, module, codes, snapshot):
+        self.module = module
+        self.codes = codes
+        self.snapshot = snapshot
+        self.in_use = True
@@ -0,0 +1,81 @@
+import collections
+import contextlib
+import sys
+import tracemalloc
+
+from pytest_check_mk.parser import bypass_caches
+
+
+# Memory allocated by a function call in bytes: at most while it ran (peak)
+# and still at its end (retained, including its result). The parse caches are
+# bypassed, so that the result does not depend on what ran before.
+MemoryUsage = collections.namedtuple('MemoryUsage', ['peak', 'retained', 'result'])
+
+
+def measure_memory(function, *args):
+    __tracebackhide__ = True
+    with bypass_caches(), _tracing():
+        start = tracemalloc.get_traced_memory()[0]
+        result = function(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    return MemoryUsage(peak - start, current - start, result)
+
+
+def peak_allocation_sites(function, *args):
+    __tracebackhide__ = True
+    # Runs function and returns the tracemalloc statistics (by line) of the
+    # memory allocated at about its peak. A snapshot is taken whenever the
+    # traced memory reached a new high as a Python function returns, while its
+    # local variables are still alive.
+    state = {'high': 0, 'overhead': 0, 'snapshot': None}
+
+    def profile(frame, event, arg):
+        if event != 'return':
+            return
+        current = tracemalloc.get_traced_memory()[0] - state['overhead']
+        # Only new highs by a tenth are worth the time to take a snapshot
+        if current > state['high'] * 1.1:
+            state['high'] = current
+            state['snapshot'] = None
+            before = tracemalloc.get_traced_memory()[0]
+            state['snapshot'] = tracemalloc.take_snapshot()
+            # Snapshots are traced as well and must not count for the next high
+            state['overhead'] += tracemalloc.get_traced_memory()[0] - before
+
+    with bypass_caches(), _tracing():
+        start = _snapshot()
+        previous_profile = sys.getprofile()
+        sys.setprofile(profile)
+        try:
+            function(*args)
+        finally:
+            sys.setprofile(previous_profile)
+        snapshot = state['snapshot'] or tracemalloc.take_snapshot()
+
+    statistics = _exclude_own_allocations(snapshot).compare_to(start, 'lineno')
+    return [statistic for statistic in statistics if statistic.size_diff > 0]
+
+
+@contextlib.contextmanager
+def _tracing():
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+def _snapshot():
+    return _exclude_own_allocations(tracemalloc.take_snapshot())
+
+
+def _exclude_own_allocations(snapshot):
+    return snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
@@ -0,0 +1,665 @@
+import array
+import codecs
+import collections
+import contextlib
+import mmap
+import re
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # Python 2
+    from collections import Sequence
+
+
+def parse_agent_output(agent_output, columnar=False):
+    __tracebackhide__ = True
+    # Splits a complete agent output into its sections in a single pass. Sections
+    # occurring more than once are joined, lines before the first header are
+    # ignored. Sections of piggybacked hosts (following a <<<<host>>>> line) are
+    # put into separate indexes, see SectionIndex.piggyback. With columnar, the
+    # info of the sections is kept in ColumnarInfo containers.
+    index = SectionIndex(columnar=columnar)
+    if _is_bytes(agent_output):
+        return _build_index_from_bytes(index, agent_output)
+    return _build_index_from_text(index, agent_output)
+
+
+def read_agent_output(source, sections=None, columnar=False):
+    __tracebackhide__ = True
+    # Like parse_agent_output, but reads the agent output line by line from a
+    # path, a file object or an mmap. If sections are given, all other sections
+    # are skipped, so memory is only needed for the requested ones.
+    return _build_index(SectionIndex(columnar=columnar), _iter_lines(source), sections)
+
+
+def iter_section_rows(source, name, host=None):
+    __tracebackhide__ = True
+    # Yields the rows of one section of the agent output in source (a path, a
+    # file object or an mmap) without keeping any of them. If host is given, the
+    # section of that piggybacked host is read instead.
+    for row_host, _, _, row in _iter_rows(_iter_lines(source), (name,)):
+        if row is not None and row_host == host:
+            yield row
+
+
+def _build_index(index, lines, wanted=None):
+    section = None
+    for host, name, options, row in _iter_rows(lines, wanted):
+        if row is None:
+            section = index.for_host(host).add(name, options)
+        else:
+            section.info.append(row)
+    return index
+
+
+# Lines are split in blocks, so a columnar section never holds all of its
+# rows as lists at once
+_SPLIT_BLOCK_SIZE = 4096
+
+
+def _build_index_from_text(index, text):
+    __tracebackhide__ = True
+    for host, name, options, start, end in _iter_sections(text):
+        section = index.for_host(host).add(name, options)
+        lines = text[start:end].splitlines()
+        for block_start in range(0, len(lines), _SPLIT_BLOCK_SIZE):
+            section.info.extend(_split_lines(lines[block_start:block_start + _SPLIT_BLOCK_SIZE], options))
+    return index
+
+
+def _build_index_from_bytes(index, data):
+    __tracebackhide__ = True
+    # Only the headers are searched for and decoded here. The sections keep
+    # views of their part of the buffer and split and decode them on first use.
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    view = memoryview(data)
+    for host, name, options, start, end in _iter_sections(data):
+        section = index.for_host(host).add(name, options, factory=_BytesSection)
+        section.add_chunk(options, view[start:end])
+    return index
+
+
+def _iter_sections(data):
+    # Yields (host, name, options, start, end) for every section in a text or
+    # bytes agent output, start and end delimiting the data lines of the section
+    host = None
+    section = None
+    for line_start, line_end, header in _iter_headers(data):
+        if section is not None:
+            yield section + (line_start,)
+            section = None
+        if is_piggyback_header(header):
+            host = piggyback_host(header)
+        else:
+            section = (host,) + parse_header(header) + (line_end,)
+    if section is not None:
+        yield section + (len(data),)
+
+
+def _iter_headers(data):
+    # Yields start and end (behind the line break) of all header lines and the
+    # decoded header. Headers are searched for in the whole output, so data
+    # lines are never looked at one by one.
+    if _is_bytes(data):
+        opening, closing, newline = b'<<<', b'>>>', b'\n'
+    else:
+        opening, closing, newline = '<<<', '>>>', '\n'
+    position = 0
+    while True:
+        position = data.find(opening, position)
+        if position == -1:
+            return
+        line_start = data.rfind(newline, 0, position) + 1
+        line_end = data.find(newline, position)
+        if line_end == -1:
+            line_end = len(data)
+        line = data[line_start:line_end].strip()
+        if not data[line_start:position].strip() and line.endswith(closing):
+            yield line_start, line_end + 1, _decode(line)
+        position = line_end
+
+
+def _iter_rows(lines, wanted=None):
+    # Yields (host, name, options, None) for every header and (host, name,
+    # options, row) for every data line of the wanted sections. host is the
+    # piggybacked host the section belongs to, or None. Lines may be bytes,
+    # which are decoded with the encoding of their section.
+    host = None
+    name = options = None
+    separator = None
+    nostrip = False
+    encoding = None
+
+    for line in lines:
+        if not isinstance(line, str):
+            line = _decode(line, encoding)
+        stripped = line.strip()
+        if stripped[:3] != '<<<' or stripped[-3:] != '>>>':
+            if name is None:
+                continue
+            # Same as _split_lines, inlined for single lines
+            if separator is None:
+                row = stripped.split()
+            elif nostrip:
+                row = line.split(separator)
+            else:
+                row = stripped.split(separator)
+            yield host, name, options, row
+        elif is_piggyback_header(stripped):
+            host = piggyback_host(stripped)
+            name = None
+            encoding = None
+        else:
+            name, options = parse_header(stripped)
+            encoding = options.get('encoding')
+            if wanted is not None and name not in wanted:
+                name = None
+                continue
+            separator = _separator(options)
+            nostrip = 'nostrip' in options
+            yield host, name, options, None
+
+
+def _iter_lines(source):
+    # Lines of a path, file object or mmap, without line endings. Binary lines
+    # are left to _iter_rows to decode.
+    if isinstance(source, mmap.mmap):
+        position = 0
+        size = len(source)
+        while position < size:
+            end = source.find(b'\n', position)
+            if end == -1:
+                end = size
+            yield source[position:end].rstrip(b'\r')
+            position = end + 1
+    elif hasattr(source, 'read'):
+        for line in source:
+            yield line.rstrip(b'\r\n' if _is_bytes(line) else '\r\n')
+    else:
+        with open(source, 'rb') as f:
+            for line in f:
+                yield line.rstrip(b'\r\n')
+
+
+def _decode(line, encoding=None):
+    if isinstance(line, str):
+        return line
+    if encoding is not None:
+        return line.decode(encoding, 'replace')
+    try:
+        return line.decode('utf-8')
+    except UnicodeDecodeError:
+        return line.decode('latin-1')
+
+
+def _is_bytes(value):
+    # On Python 2, str is bytes as well and is parsed like text
+    return isinstance(value, (bytes, bytearray, memoryview)) and not isinstance(value, str)
+
+
+class SectionIndex(object):
+    # Sections of an agent output by name. An index can be passed instead of
+    # the output of a single section to CheckWrapper.inventory and check.
+
+    def __init__(self, columnar=False):
+        self.columnar = columnar
+        self._sections = {}
+        # Indexes of the hosts piggybacked in the agent output, by host name
+        self.piggyback = {}
+
+    def for_host(self, host):
+        # The index for the sections of a piggybacked host, or this one for None
+        if host is None:
+            return self
+        if host not in self.piggyback:
+            self.piggyback[host] = SectionIndex(columnar=self.columnar)
+        return self.piggyback[host]
+
+    def hosts(self):
+        # Yields (host, index) for this host (as None) and all piggybacked hosts
+        yield None, self
+        for host in sorted(self.piggyback):
+            yield host, self.piggyback[host]
+
+    def add(self, name, options, factory=None):
+        if name not in self._sections:
+            info = ColumnarInfo() if self.columnar else []
+            self._sections[name] = (factory or Section)(name, options, info)
+        return self._sections[name]
+
+    def __getitem__(self, name):
+        return self._sections[name]
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def __len__(self):
+        return len(self._sections)
+
+    def get(self, name, default=None):
+        return self._sections.get(name, default)
+
+
+class Section(object):
+
+    def __init__(self, name, options, info=None):
+        self.name = name
+        self.options = options
+        self._info = [] if info is None else info
+
+    @property
+    def info(self):
+        return self._info
+
+    def copy_info(self):
+        return copy_info(self.info)
+
+    @property
+    def separator(self):
+        return _separator(self.options)
+
+    @property
+    def nostrip(self):
+        return 'nostrip' in self.options
+
+    @property
+    def encoding(self):
+        return self.options.get('encoding')
+
+    @property
+    def cached(self):
+        # (timestamp, interval) of a section the agent generates asynchronously
+        value = self.options.get('cached')
+        return None if value is None else _cached_option(value)
+
+    @property
+    def persist(self):
+        # Timestamp until which the section stays valid
+        value = self.options.get('persist')
+        return None if value is None else int(value)
+
+
+def copy_info(info):
+    # Check functions may change the info they get, so each one gets a copy.
+    # ColumnarInfo builds new rows on every access and is never changed.
+    if isinstance(info, ColumnarInfo):
+        return info
+    return [list(row) for row in info]
+
+
+class _BytesSection(Section):
+    # Section of a bytes agent output, split and decoded on first access. Every
+    # occurrence of the section is kept as a view of the buffer with the options
+    # of its own header.
+
+    def __init__(self, name, options, info=None):
+        super(_BytesSection, self).__init__(name, options, info)
+        self._chunks = []
+
+    def add_chunk(self, options, chunk):
+        self._chunks.append((options, chunk))
+
+    @property
+    def info(self):
+        if self._chunks is not None:
+            for options, chunk in self._chunks:
+                self._info.extend(_split_byte_lines(chunk, options))
+            self._chunks = None
+        return self._info
+
+
+# Interned tokens of a ColumnarInfo are kept in a list, the other fields are
+# only kept as text. A token is interned when it occurs again within the last
+# _INTERN_WINDOW distinct tokens.
+_INTERN_WINDOW = 4096
+_MAX_INTERNED = 0x8000
+
+
+class ColumnarInfo(Sequence):
+    # Info of a section as a sequence of rows, without a list per row and a
+    # string per field. The text of all fields is kept in a single UTF-8
+    # buffer. Every field is an entry in an array of 16 bit integers (32 bit
+    # once a row has more than 32 KiB of text): the end of its text, relative
+    # to the start of the row, or, with the highest bit set, the id of an
+    # interned token. Rows are built as new lists on every access.
+    #
+    # Interning only pays off for tokens that repeat, like user names, states
+    # or device names, so unique values like counters or PIDs cost nothing but
+    # their text.
+
+    def __init__(self, rows=()):
+        self._buffer = bytearray()
+        self._fields = array.array('H')
+        self._interned = 0x8000
+        # Index of the first field and offset in the buffer of every row
+        self._row_fields = array.array('I', [0])
+        self._row_starts = array.array('I', [0])
+        self._tokens = []
+        self._token_ids = {}
+        self._recent = set()
+        self.extend(rows)
+
+    def append(self, row):
+        self.extend((row,))
+
+    def extend(self, rows):
+        for row in rows:
+            entries, texts, text = self._row_entries(row)
+            if len(text) >= self._interned:
+                self._widen()
+                entries, texts, text = self._row_entries(row)
+            self._buffer += text
+            if len(self._buffer) >= 1 << 32:
+                raise OverflowError('ColumnarInfo can only hold 4 GiB of text')
+            self._fields.extend(entries)
+            self._row_fields.append(len(self._fields))
+            self._row_starts.append(len(self._buffer))
+
+    def _row_entries(self, row):
+        tokens = self._tokens
+        token_ids = self._token_ids
+        recent = self._recent
+        interned = self._interned
+        entries = []
+        texts = []
+        end = 0
+        for token in row:
+            token_id = token_ids.get(token)
+            if token_id is None:
+                # Only hashes are kept of the recent tokens, a collision just
+                # interns a token early
+                token_hash = hash(token)
+                if token_hash in recent and len(tokens) < _MAX_INTERNED:
+                    token_id = token_ids[token] = len(tokens)
+                    tokens.append(token)
+            if token_id is not None:
+                entries.append(token_id | interned)
+                continue
+
+            if len(recent) >= _INTERN_WINDOW:
+                recent.clear()
+            recent.add(token_hash)
+            texts.append(token)
+            end += len(token)
+            entries.append(end)
+
+        text = ''.join(texts).encode('utf-8')
+        if len(text) != end:
+            # The ends are in characters so far, not in bytes
+            lengths = iter([len(token.encode('utf-8')) for token in texts])
+            end = 0
+            for i, entry in enumerate(entries):
+                if not entry & interned:
+                    end += next(lengths)
+                    entries[i] = end
+        return entries, texts, text
+
+    def _widen(self):
+        interned = 0x80000000
+        self._fields = array.array('I', [(entry ^ self._interned) | interned if entry & self._interned else entry
+                                         for entry in self._fields])
+        self._interned = interned
+
+    def __len__(self):
+        return len(self._row_fields) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('ColumnarInfo index out of range')
+        return self._row(self._fields[self._row_fields[index]:self._row_fields[index + 1]],
+                         self._buffer[self._row_starts[index]:self._row_starts[index + 1]])
+
+    def __iter__(self):
+        fields = self._fields
+        buffer = self._buffer
+        row_starts = self._row_starts
+        first = 0
+        for index, last in enumerate(self._row_fields[1:]):
+            yield self._row(fields[first:last], buffer[row_starts[index]:row_starts[index + 1]])
+            first = last
+
+    def _row(self, fields, raw):
+        tokens = self._tokens
+        interned = self._interned
+        text = raw.decode('utf-8')
+        if len(text) != len(raw):
+            # Slices of the text would not match the byte offsets
+            text = raw
+            decode = True
+        else:
+            decode = False
+        row = []
+        start = 0
+        for field in fields:
+            if field & interned:
+                row.append(tokens[field ^ interned])
+            else:
+                row.append(text[start:field].decode('utf-8') if decode else text[start:field])
+                start = field
+        return row
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(self) == len(other) and all(row == list(other_row) for row, other_row in zip(self, other))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ColumnarInfo({!r})'.format(list(self))
+
+
+class LRUCache(object):
+    # Mapping with a bounded number of entries, evicting the least recently used.
+    # With maxbytes, the sizes given to put are bounded in total as well, and
+    # values larger than maxbytes are not stored at all.
+    # Within bypass_caches(), every lookup misses and nothing is stored.
+
+    _bypassed = 0
+
+    def __init__(self, maxsize, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+
+    def get(self, key, default=None):
+        if LRUCache._bypassed:
+            return default
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, size=0):
+        if LRUCache._bypassed:
+            return
+        self._remove(key)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while len(self._entries) > self.maxsize or (self.maxbytes is not None and self._bytes > self.maxbytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+@contextlib.contextmanager
+def bypass_caches():
+    # Parses (and runs parse functions) again for every call within the block,
+    # as if nothing was cached before, and keeps nothing in the caches
+    LRUCache._bypassed += 1
+    try:
+        yield
+    finally:
+        LRUCache._bypassed -= 1
+
+
+# Inventory and check of every item parse the same output again, so parsed
+# sections are cached by their output. The parsed rows take several times the
+# memory of the output, so the cache holds at most 16 MiB of output for the
+# whole session and outputs larger than that are parsed for every call.
+_parse_info_cache = LRUCache(maxsize=128, maxbytes=16 * 2 ** 20)
+
+
+def parse_info(check_output):
+    __tracebackhide__ = True
+    if LRUCache._bypassed:
+        return _parse_info(check_output)
+    cached = _parse_info_cache.get(check_output)
+    if cached is None:
+        section_name, info = _parse_info(check_output)
+        cached = section_name, tuple(tuple(row) for row in info)
+        _parse_info_cache.put(check_output, cached, len(check_output))
+
+    # Check functions may change their info, so each call gets fresh lists
+    section_name, rows = cached
+    return section_name, [list(row) for row in rows]
+
+
+def parse_info_cache_info():
+    return _parse_info_cache.info()
+
+
+def parse_info_cache_clear():
+    _parse_info_cache.clear()
+
+
+def _parse_info(check_output):
+    __tracebackhide__ = True
+    lines = check_output.splitlines()
+
+    section_name, section_options = parse_header(lines[0].strip())
+
+    # Only look at the lines one by one if there may be a second header at all
+    if '<<<' in check_output[len(lines[0]):]:
+        for line in lines[1:]:
+            if is_header(line):
+                raise ValueError('Test data contains a second section header: {}'.format(line.strip()))
+
+    return section_name, _split_lines(lines[1:], section_options)
+
+
+# Section options are name(value), nostrip may be given without a value
+_OPTION_RE = re.compile(r'([^(]+)(?:\((.*)\))?$')
+
+
+def parse_header(header):
+    __tracebackhide__ = True
+
+    if not is_header(header):
+        raise ValueError('Invalid header in test data: {}'.format(header))
+
+    header_items = header.strip()[3:-3].split(':')
+    name = header_items[0]
+    section_options = {}
+    for option in header_items[1:]:
+        match = _OPTION_RE.match(option)
+        if match is None or not _valid_option(*match.groups()):
+            raise ValueError('Invalid section option {}'.format(option))
+        key, value = match.groups()
+        section_options[key] = value
+
+    return name, section_options
+
+
+def _valid_option(key, value):
+    try:
+        if key in ('sep', 'persist'):
+            int(value)
+        elif key == 'cached':
+            _cached_option(value)
+        elif key == 'encoding':
+            codecs.lookup(value)
+    except (TypeError, ValueError, LookupError):
+        return False
+    return True
+
+
+def _cached_option(value):
+    # cached(timestamp,interval) as written by the agents for asynchronous
+    # sections
+    timestamp, interval = value.split(',')
+    return int(timestamp), int(interval)
+
+
+def is_piggyback_header(line):
+    return line[:4] == '<<<<' and line[-4:] == '>>>>'
+
+
+def piggyback_host(header):
+    # <<<<>>>> switches back to the monitored host itself
+    return header[4:-4] or None
+
+
+def is_header(line):
+    __tracebackhide__ = True
+    line = line.strip()
+    return line[:3] == '<<<' and line[-3:] == '>>>'
+
+
+def _split_lines(lines, options):
+    # Splitting on whitespace ignores surrounding whitespace, so only lines split
+    # by a separator are stripped, unless nostrip is set
+    separator = _separator(options)
+    if separator is None:
+        return [line.split() for line in lines]
+    if 'nostrip' in options:
+        return [line.split(separator) for line in lines]
+    return [line.strip().split(separator) for line in lines]
+
+
+def _split_byte_lines(chunk, options):
+    # The separator is split off before decoding, which is safe for all ASCII
+    # compatible encodings
+    separator = _separator(options)
+    if separator is not None:
+        separator = separator.encode('latin-1')
+    nostrip = 'nostrip' in options
+    encoding = options.get('encoding')
+
+    for line in chunk.tobytes().splitlines():
+        if not nostrip:
+            line = line.strip()
+        yield [_decode(field, encoding) for field in line.split(separator)]
+
+
+def _separator(section_options):
+    try:
+        return chr(int(section_options['sep']))
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
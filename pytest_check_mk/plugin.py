@@ -1,6 +1,157 @@
 import pytest
 
-from pytest_check_mk.wrapper import AgentDirectoryWrapper, create_check_file_wrapper
+
+# The plugin is loaded by every pytest run via its entry point, so the rest of
+# pytest_check_mk is only imported once one of the fixtures is used.
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('check_mk')
+    group.addoption('--check-mk-no-bytecode-cache', action='store_true', default=False,
+                    help='Do not store compiled check files in the pytest cache directory.')
+    group.addoption('--check-mk-no-module-reuse', action='store_true', default=False,
+                    help='Execute the check file for every test instead of resetting the module between tests.')
+    group.addoption('--check-mk-precompile', action='store_true', default=False,
+                    help='Compile all files in the checks directory in parallel when the session starts.')
+    group.addoption('--check-mk-changed', action='store_true', default=False,
+                    help='Only run tests whose test file, check file, includes or agents changed since they '
+                         'last passed.')
+    group.addoption('--check-mk-watch', action='store_true', default=False,
+                    help='Run the tests, then watch checks, agents and test files and re-run the tests affected '
+                         'by every change.')
+    group.addoption('--check-mk-timeout', metavar='SECONDS', type=float, default=None,
+                    help='Wall clock budget of every inventory, check and parse function call.')
+    group.addoption('--check-mk-cpu-budget', metavar='SECONDS', type=float, default=None,
+                    help='CPU time budget of every inventory, check and parse function call.')
+    group.addoption('--check-mk-isolated', action='store_true', default=False,
+                    help='Enforce budgets in a forked worker process, which can also stop functions stuck in C code.')
+    group.addoption('--check-mk-benchmark-threshold', metavar='FACTOR', type=float, default=2.0,
+                    help='Fail check_benchmark measurements slower than their baseline by more than FACTOR '
+                         '(default: 2.0).')
+    group.addoption('--check-mk-benchmark-update', action='store_true', default=False,
+                    help='Store the check_benchmark measurements as new baselines.')
+    group.addoption('--check-mk-benchmark-rounds', metavar='N', type=int, default=20,
+                    help='Number of rounds of check_benchmark measurements (default: 20).')
+    group.addoption('--check-mk-corpus', metavar='DIR', default=None,
+                    help='Directory of agent outputs for the corpus fixture.')
+    group.addoption('--check-mk-corpus-processes', metavar='N', type=int, default=None,
+                    help='Number of processes checking the agent outputs of the corpus (default: number of CPUs).')
+    group.addoption('--check-mk-profile', action='store_true', default=False,
+                    help='Profile the inventory, check and parse function calls by check plugin and write .pstats '
+                         'and collapsed stacks (for flame graphs) per check plugin.')
+    group.addoption('--check-mk-profile-dir', metavar='DIR', default='check_mk_profile',
+                    help='Directory for the profiles of --check-mk-profile (default: check_mk_profile).')
+    group.addoption('--check-mk-profile-top', metavar='N', type=int, default=10,
+                    help='Number of the hot functions in check files listed by --check-mk-profile (default: 10).')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'check_mk_budget(wall=None, cpu=None, isolated=None): budget of the '
+                                       'inventory, check and parse function calls of the test, in seconds')
+    if config.getoption('check_mk_changed') and getattr(config, 'cache', None) is not None:
+        from pytest_check_mk.selection import ChangeTracker
+        config.pluginmanager.register(ChangeTracker(config, _get_code_cache(config)), 'check_mk_change_tracker')
+    if config.getoption('check_mk_profile'):
+        from pytest_check_mk.profiling import CheckProfiler
+        config._check_mk_profiler = CheckProfiler()
+
+
+def pytest_cmdline_main(config):
+    if config.getoption('check_mk_watch'):
+        from pytest_check_mk.watch import watch
+        return watch(config)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionstart(session):
+    config = session.config
+    # With xdist, only the master precompiles; workers read the on-disk cache
+    if not config.getoption('check_mk_precompile') or hasattr(config, 'workerinput'):
+        return
+
+    from pytest_check_mk.file_loader import find_check_files
+    paths = find_check_files()
+    errors = _get_code_cache(config).precompile(paths)
+    config._check_mk_precompile_result = (len(paths), errors)
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    profiler = getattr(config, '_check_mk_profiler', None)
+    if profiler is None:
+        return
+
+    # With xdist, every worker writes the profiles of the tests it ran
+    workerinput = getattr(config, 'workerinput', None)
+    suffix = '.' + workerinput['workerid'] if workerinput else ''
+    config._check_mk_profile_paths = profiler.write(config.getoption('check_mk_profile_dir'), suffix)
+
+
+def pytest_report_header(config):
+    result = getattr(config, '_check_mk_precompile_result', None)
+    if result is None:
+        return None
+
+    count, errors = result
+    lines = ['check_mk: precompiled {} files from checks, {} failed'.format(count, len(errors))]
+    lines.extend('    {}: {}'.format(path, message) for path, message in errors)
+    return lines
+
+
+def pytest_terminal_summary(terminalreporter):
+    config = terminalreporter.config
+    reports = getattr(config, '_check_mk_corpus_reports', None)
+    if reports:
+        terminalreporter.section('check_mk corpus')
+        for report in reports:
+            for line in report.summary_lines():
+                terminalreporter.write_line(line)
+
+    results = getattr(config, '_check_mk_benchmark_results', None)
+    if results:
+        terminalreporter.section('check_mk benchmarks')
+        for result in results:
+            terminalreporter.write_line(result.summary_line())
+
+    profiler = getattr(config, '_check_mk_profiler', None)
+    if profiler is not None:
+        terminalreporter.section('check_mk profile')
+        for line in profiler.summary_lines(config.getoption('check_mk_profile_top')):
+            terminalreporter.write_line(line)
+        paths = getattr(config, '_check_mk_profile_paths', [])
+        terminalreporter.write_line('{} profiles written to {}'.format(
+            len(paths) // 2, config.getoption('check_mk_profile_dir')))
+
+
+def _get_code_cache(config):
+    # Compiled check files are shared by all tests of the session
+    if getattr(config, '_check_mk_code_cache', None) is None:
+        from pytest_check_mk.file_loader import CodeCache
+        config._check_mk_code_cache = CodeCache(directory=_bytecode_cache_dir(config))
+    return config._check_mk_code_cache
+
+
+def _get_module_pool(config):
+    if config.getoption('check_mk_no_module_reuse'):
+        return None
+
+    if getattr(config, '_check_mk_module_pool', None) is None:
+        from pytest_check_mk.isolation import ModulePool
+        config._check_mk_module_pool = ModulePool(_get_code_cache(config))
+    return config._check_mk_module_pool
+
+
+def _bytecode_cache_dir(config):
+    if config.getoption('check_mk_no_bytecode_cache'):
+        return None
+
+    cache = getattr(config, 'cache', None)
+    if cache is None:
+        return None
+
+    # Cache.makedir was renamed to Cache.mkdir in pytest 7
+    mkdir = getattr(cache, 'mkdir', None) or cache.makedir
+    return str(mkdir('check_mk_bytecode'))
 
 
 def _get_check_name(request):
@@ -13,9 +164,77 @@ def _get_check_name(request):
 
 @pytest.fixture
 def agents(request):
-    return AgentDirectoryWrapper()
+    from pytest_check_mk.wrapper import AgentDirectoryWrapper
+    agents = AgentDirectoryWrapper()
+    # Used agents are dependencies of the test for --check-mk-changed
+    request.node._check_mk_agents = agents
+    return agents
 
 
 @pytest.fixture
 def checks(request):
-    return create_check_file_wrapper(_get_check_name(request))
+    from pytest_check_mk.wrapper import create_check_file_wrapper
+    config = request.config
+    module_pool = _get_module_pool(config)
+    check_file = create_check_file_wrapper(_get_check_name(request), code_cache=_get_code_cache(config),
+                                           module_pool=module_pool)
+    if module_pool is not None:
+        request.addfinalizer(lambda: _release_module(module_pool, check_file))
+    check_file.budget = _get_budget(request)
+    check_file.profiler = getattr(config, '_check_mk_profiler', None)
+    return check_file
+
+
+def _get_budget(request):
+    # Budget from the command line options, overridden by a check_mk_budget marker
+    config = request.config
+    settings = {
+        'wall': config.getoption('check_mk_timeout'),
+        'cpu': config.getoption('check_mk_cpu_budget'),
+        'isolated': config.getoption('check_mk_isolated'),
+    }
+    # Node.get_marker was replaced by get_closest_marker in pytest 3.6
+    get_marker = getattr(request.node, 'get_closest_marker', None) or request.node.get_marker
+    marker = get_marker('check_mk_budget')
+    if marker is not None:
+        settings.update((key, value) for key, value in marker.kwargs.items() if value is not None)
+    if settings['wall'] is None and settings['cpu'] is None:
+        return None
+
+    from pytest_check_mk.budget import Budget
+    return Budget(**settings)
+
+
+def _release_module(module_pool, check_file):
+    if check_file.is_loaded:
+        module_pool.release(check_file.module)
+
+
+@pytest.fixture
+def corpus(request):
+    config = request.config
+    directory = config.getoption('check_mk_corpus')
+    if directory is None:
+        pytest.skip('No corpus of agent outputs given, use --check-mk-corpus=DIR')
+
+    from pytest_check_mk.corpus import Corpus
+    corpus = Corpus(directory, _get_check_name(request), processes=config.getoption('check_mk_corpus_processes'),
+                    cache_directory=_bytecode_cache_dir(config))
+    if getattr(config, '_check_mk_corpus_reports', None) is None:
+        config._check_mk_corpus_reports = []
+    request.addfinalizer(lambda: config._check_mk_corpus_reports.extend(corpus.reports))
+    return corpus
+
+
+@pytest.fixture
+def check_benchmark(request):
+    from pytest_check_mk.benchmark import CheckBenchmark
+    config = request.config
+    benchmark = CheckBenchmark(request.node.nodeid, cache=getattr(config, 'cache', None),
+                               threshold=config.getoption('check_mk_benchmark_threshold'),
+                               update=config.getoption('check_mk_benchmark_update'),
+                               rounds=config.getoption('check_mk_benchmark_rounds'))
+    if getattr(config, '_check_mk_benchmark_results', None) is None:
+        config._check_mk_benchmark_results = []
+    request.addfinalizer(lambda: config._check_mk_benchmark_results.extend(benchmark.results))
+    return benchmark
@@ -0,0 +1,133 @@
+import collections
+import cProfile
+import os
+import pstats
+import types
+
+
+# Paths longer than this are cut from collapsed stacks, they only happen with
+# deep recursion through several functions and would not be readable anyway
+_MAX_DEPTH = 64
+
+# Statistics of a function in the profile of a check plugin, times in seconds
+HotFunction = collections.namedtuple('HotFunction', ['check', 'function', 'calls', 'self_time', 'total_time'])
+
+
+class CheckProfiler(object):
+    # Profiles the inventory, check and parse function calls made through
+    # CheckWrapper, aggregated by the name of the check plugin over the whole
+    # session. Calls in isolated budget workers are not profiled.
+
+    def __init__(self):
+        self.profiles = {}
+
+    def call(self, name, function, *args):
+        __tracebackhide__ = True
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active, like a profiled pytest run
+            return function(*args)
+        try:
+            result = function(*args)
+        finally:
+            profile.disable()
+        # Generators do their work when they are iterated
+        if isinstance(result, types.GeneratorType):
+            profile.enable()
+            try:
+                result = list(result)
+            finally:
+                profile.disable()
+        return result
+
+    def stats(self, name):
+        stats = pstats.Stats(self.profiles[name])
+        # The profiler calls disable itself, which is not part of the check
+        for function in list(stats.stats):
+            if function[2] == "<method 'disable' of '_lsprof.Profiler' objects>":
+                del stats.stats[function]
+        return stats
+
+    def write(self, directory, suffix=''):
+        # Writes <check>.pstats (for pstats or snakeviz) and <check>.collapsed
+        # (for flamegraph.pl or speedscope) per check plugin. Returns the paths.
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        paths = []
+        for name in sorted(self.profiles):
+            stats = self.stats(name)
+            path = os.path.join(directory, name + suffix)
+            stats.dump_stats(path + '.pstats')
+            with open(path + '.collapsed', 'w') as f:
+                for stack, microseconds in sorted(collapsed_stacks(stats.stats).items()):
+                    f.write('{} {}\n'.format(stack, microseconds))
+            paths.extend([path + '.pstats', path + '.collapsed'])
+        return paths
+
+    def hot_functions(self, count=10, directory='checks'):
+        # Functions defined in the check files (and include files) that took
+        # the most time themselves, over all check plugins
+        directory = os.path.abspath(directory) + os.sep
+        functions = []
+        for name in self.profiles:
+            for function, (_, calls, self_time, total_time, _) in self.stats(name).stats.items():
+                if os.path.abspath(function[0]).startswith(directory):
+                    functions.append(HotFunction(name, function, calls, self_time, total_time))
+        functions.sort(key=lambda hot: hot.self_time, reverse=True)
+        return functions[:count]
+
+    def summary_lines(self, count=10, directory='checks'):
+        return ['{:10.6f}s self {:10.6f}s total {:8d} calls  {}: {}'.format(
+            hot.self_time, hot.total_time, hot.calls, hot.check, function_label(hot.function))
+            for hot in self.hot_functions(count, directory)]
+
+
+def function_label(function):
+    filename, line, name = function
+    if filename == '~':  # built-in function
+        return name
+    return '{}:{}({})'.format(filename, line, name)
+
+
+def collapsed_stacks(stats):
+    # Stacks in the collapsed format of flamegraph.pl, with the time (in
+    # microseconds) spent in the last function of each. cProfile only records
+    # caller and callee pairs, so stacks are rebuilt from the callers and the
+    # time of a function called from several places is split among them by
+    # how much time it took when called from each.
+    callees = collections.defaultdict(dict)
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, total_time) in callers.items():
+            callees[caller][function] = total_time
+
+    stacks = collections.Counter()
+
+    def walk(function, path, share):
+        path = path + (function,)
+        self_time = stats[function][2] * share
+        if self_time > 0:
+            stacks[';'.join(function_label(f) for f in path)] += self_time
+        if len(path) >= _MAX_DEPTH:
+            return
+        for callee, edge_time in callees[function].items():
+            callee_time = stats[callee][3]
+            # Recursion is folded into the outermost call of the function
+            if callee in path or callee_time <= 0:
+                continue
+            callee_share = share * min(edge_time / callee_time, 1.0)
+            # Paths below half a microsecond would be dropped anyway
+            if callee_share * callee_time >= 5e-7:
+                walk(callee, path, callee_share)
+
+    # Calls made by the profiler itself have no caller, which makes them roots.
+    # Recursive calls are no calls from another function.
+    for function, (_, _, _, total_time, callers) in stats.items():
+        called_time = sum(edge[3] for caller, edge in callers.items() if caller != function)
+        if total_time > 0 and called_time < total_time:
+            walk(function, (), 1.0 - called_time / total_time)
+
+    return collections.Counter(dict((stack, int(round(seconds * 1e6)))
+                                    for stack, seconds in stacks.items() if seconds * 1e6 >= 0.5))
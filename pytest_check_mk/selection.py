@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from pytest_check_mk import MissingFileError
+from pytest_check_mk.file_loader import file_digest
+
+
+class ChangeTracker(object):
+    # Plugin deselecting tests whose dependencies did not change since they last
+    # passed. The dependencies are stored with their content hashes in the
+    # pytest cache.
+    #
+    # With xdist, the workers pass the dependencies of their tests to the
+    # controller, which stores them for all workers.
+
+    CACHE_KEY = 'check_mk/dependencies'
+    WORKER_OUTPUT_KEY = 'check_mk_dependencies'
+
+    def __init__(self, config, code_cache):
+        self.config = config
+        self.code_cache = code_cache
+        self.recorded = config.cache.get(self.CACHE_KEY, {})
+        self.dependencies = {}
+        self.failed = set()
+
+    def pytest_collection_modifyitems(self, session, config, items):
+        digests = {}
+        selected = []
+        deselected = []
+        for item in items:
+            if self._unchanged(self.recorded.get(item.nodeid), digests):
+                deselected.append(item)
+            else:
+                selected.append(item)
+
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
+
+    def _unchanged(self, dependencies, digests):
+        if not dependencies:
+            return False
+        for path, digest in dependencies.items():
+            if path not in digests:
+                digests[path] = file_digest(path)
+            if digests[path] != digest:
+                return False
+        return True
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        yield
+        if call.when == 'call':
+            self.dependencies[item.nodeid] = dependencies_of(item, self.code_cache)
+
+    def pytest_runtest_logreport(self, report):
+        if report.failed:
+            self.failed.add(report.nodeid)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        # Called on the xdist controller for every worker that finished
+        output = getattr(node, 'workeroutput', {}).get(self.WORKER_OUTPUT_KEY)
+        if output is not None:
+            dependencies, failed = output
+            self.dependencies.update(dependencies)
+            self.failed.update(failed)
+
+    def pytest_sessionfinish(self, session):
+        workeroutput = getattr(self.config, 'workeroutput', None)
+        if workeroutput is not None:
+            workeroutput[self.WORKER_OUTPUT_KEY] = (self.dependencies, sorted(self.failed))
+            return
+
+        # Merged with what is stored now, in case another session stored
+        # dependencies since this one started
+        recorded = self.config.cache.get(self.CACHE_KEY, {})
+        for nodeid, dependencies in self.dependencies.items():
+            if nodeid not in self.failed:
+                recorded[nodeid] = dependencies
+        for nodeid in self.failed:
+            recorded.pop(nodeid, None)
+        self.config.cache.set(self.CACHE_KEY, recorded)
+
+
+def dependencies_of(item, code_cache):
+    # Maps the paths of all files a test depends on to their content hashes: its
+    # test file, the check file named by test_for with all its includes and the
+    # agents it ran
+    dependencies = {}
+
+    path = os.path.abspath(str(item.fspath))
+    dependencies[path] = file_digest(path)
+
+    test_for = getattr(getattr(item, 'module', None), 'test_for', None)
+    if test_for is not None:
+        try:
+            for compiled_file in code_cache.load_order(os.path.join('checks', test_for)):
+                dependencies[compiled_file.path] = compiled_file.digest
+        except (MissingFileError, SyntaxError):
+            pass
+
+    agents = getattr(item, '_check_mk_agents', None)
+    if agents is not None:
+        for agent_path in agents.used_paths:
+            path = os.path.abspath(agent_path)
+            dependencies[path] = file_digest(path)
+
+    return dependencies
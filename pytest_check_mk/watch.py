@@ -0,0 +1,163 @@
+import os
+import sys
+import time
+
+import pytest
+
+from pytest_check_mk.selection import dependencies_of
+
+
+POLL_INTERVAL = 0.5
+
+# Exit code of a run stopped with Ctrl+C, pytest.ExitCode is new in pytest 5
+_INTERRUPTED = getattr(getattr(pytest, 'ExitCode', None), 'INTERRUPTED', 2)
+
+
+def watch(config, sleep=time.sleep):
+    # Runs the selected tests, then polls the checks and agents directories and
+    # the test files and re-runs the tests affected by every change. All runs
+    # happen in this process and share the compiled and executed check modules.
+    watcher = Watcher(config)
+    base_args = watcher.base_args()
+
+    exit_code = watcher.run(base_args + watcher.test_paths)
+    try:
+        # Ctrl+C during a run is handled by pytest.main, which returns
+        # INTERRUPTED, and during polling raises KeyboardInterrupt here
+        while exit_code != _INTERRUPTED:
+            changed = watcher.changed_files()
+            if not changed:
+                sleep(POLL_INTERVAL)
+                continue
+
+            tests = watcher.affected_tests(changed)
+            for path in changed:
+                if path.endswith('.py'):
+                    _forget_module(path)
+            watcher.report('{} file(s) changed, running {} test(s)'.format(
+                len(changed), 'all' if tests is None else len(tests)))
+            if tests is None:
+                exit_code = watcher.run(base_args + watcher.test_paths)
+            elif tests:
+                exit_code = watcher.run(base_args + tests)
+    except KeyboardInterrupt:
+        pass
+    return exit_code
+
+
+class Watcher(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.rootdir = str(config.rootdir)
+        self.test_paths = [os.path.abspath(arg.split('::')[0]) for arg in config.args] or [self.rootdir]
+        self.dependencies = {}
+        self._session_plugin = _WarmSession(self)
+        self._stamps = self._scan()
+
+    def base_args(self):
+        # Command line arguments for the test runs: everything but the test paths
+        # and the watch option itself
+        args = getattr(getattr(self.config, 'invocation_params', None), 'args', None)
+        if args is None:
+            args = sys.argv[1:]
+        return [arg for arg in args if arg != '--check-mk-watch' and arg not in self.config.args]
+
+    def run(self, args):
+        return pytest.main(list(args), plugins=[self._session_plugin])
+
+    def report(self, message):
+        # The config of the watcher is never configured, so it has no terminal
+        # reporter. Each run has its own, which is gone between the runs.
+        sys.stdout.write('check_mk watch: {}\n'.format(message))
+        sys.stdout.flush()
+
+    def changed_files(self):
+        stamps = self._scan()
+        changed = set(path for path in set(stamps) | set(self._stamps)
+                      if stamps.get(path) != self._stamps.get(path))
+        self._stamps = stamps
+        return changed
+
+    def affected_tests(self, changed):
+        # Node ids of the tests depending on the changed files, or None if all
+        # tests need to run because a changed Python file is not a known test file
+        known_test_files = set(nodeid.split('::')[0] for nodeid in self.dependencies)
+        tests = []
+        for nodeid, dependencies in sorted(self.dependencies.items()):
+            if changed.intersection(dependencies):
+                tests.append(nodeid)
+
+        for path in changed:
+            if path.endswith('.py') and not self._is_check_or_agent(path) and path not in known_test_files:
+                return None
+
+        return tests
+
+    def _is_check_or_agent(self, path):
+        return any(path.startswith(os.path.join(os.path.abspath(directory), ''))
+                   for directory in ('checks', 'agents'))
+
+    def _scan(self):
+        stamps = {}
+        for directory in ('checks', 'agents'):
+            for path in _walk(os.path.abspath(directory)):
+                stamps[path] = _stamp(path)
+        for test_path in self.test_paths:
+            paths = [test_path] if os.path.isfile(test_path) else _walk(test_path)
+            for path in paths:
+                if path.endswith('.py'):
+                    stamps[path] = _stamp(path)
+        return stamps
+
+
+class _WarmSession(object):
+    # Plugin for the test runs of the watcher, sharing its compiled and executed
+    # check modules and recording the dependencies of every test
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.code_cache = None
+        self.module_pool = None
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_configure(self, config):
+        if self.code_cache is not None:
+            config._check_mk_code_cache = self.code_cache
+            config._check_mk_module_pool = self.module_pool
+
+    def pytest_unconfigure(self, config):
+        self.code_cache = getattr(config, '_check_mk_code_cache', None)
+        self.module_pool = getattr(config, '_check_mk_module_pool', None)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        from pytest_check_mk.plugin import _get_code_cache
+
+        yield
+        if call.when == 'call':
+            nodeid = os.path.join(str(item.config.rootdir), item.nodeid)
+            self.watcher.dependencies[nodeid] = dependencies_of(item, _get_code_cache(item.config))
+
+
+def _walk(directory):
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.') and name != '__pycache__']
+        for filename in filenames:
+            yield os.path.join(dirpath, filename)
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size
+
+
+def _forget_module(path):
+    # Changed test modules have to be imported again by the next run
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, '__file__', None)
+        if module_file and os.path.splitext(os.path.abspath(module_file))[0] == os.path.splitext(path)[0]:
+            del sys.modules[name]
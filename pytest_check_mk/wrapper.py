@@ -1,33 +1,112 @@
+import collections
+import functools
 import os.path
-import re
 import subprocess
+import time
 
 from pytest import UsageError
 
-from pytest_check_mk import MissingFileError
-from pytest_check_mk.file_loader import check_module_from_source
+from pytest_check_mk import BudgetExceeded, MissingFileError
+from pytest_check_mk.file_loader import CodeCache, check_module_from_source
+from pytest_check_mk.parser import (LRUCache, SectionIndex, _is_bytes, _parse_info, copy_info, parse_agent_output,
+                                    parse_info)
+from pytest_check_mk.parser import is_header, parse_header  # noqa (moved to parser)
 
 
-def create_check_file_wrapper(name):
+def create_check_file_wrapper(name, code_cache=None, module_pool=None):
     path = os.path.join('checks', name)
 
-    module = check_module_from_source(name, path)
-    return CheckFileWrapper(name, module)
+    if not os.path.exists(path):
+        raise MissingFileError(path)
+
+    if module_pool is not None:
+        code_cache = module_pool.code_cache
+    elif code_cache is None:
+        code_cache = CodeCache()
+
+    def load_module():
+        __tracebackhide__ = True
+        if module_pool is not None:
+            return module_pool.acquire(name, path)
+        return check_module_from_source(name, path, code_cache=code_cache)
+
+    return CheckFileWrapper(name, load_module=load_module, path=path, code_cache=code_cache)
+
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Results of CheckWrapper.check_many, each by item: the results of the items
+# checked successfully, the time taken by every check in seconds and the
+# exceptions raised by the failed checks
+CheckManyResult = collections.namedtuple('CheckManyResult', ['results', 'timings', 'errors'])
+
+# Marks a missing entry in the cache of parsed sections, as parse functions
+# may return None
+_NOT_PARSED = object()
 
 
 class CheckFileWrapper(object):
+    # The check file is executed on first access to the module, so tests that
+    # never use it (or only ask for check_names) do not pay for loading it.
 
-    def __init__(self, name, module):
+    def __init__(self, name, module=None, load_module=None, path=None, code_cache=None):
         self.name = name
-        self.module = module
+        self.path = path
+        self._module = module
+        self._load_module = load_module
+        self._code_cache = code_cache
+        self._parsed = LRUCache(maxsize=32)
+        # Default budget of the inventory, check and parse functions
+        self.budget = None
+        # CheckProfiler of the session with --check-mk-profile
+        self.profiler = None
+
+    @property
+    def module(self):
+        __tracebackhide__ = True
+        if self._module is None:
+            self._module = self._load_module()
+        return self._module
+
+    @property
+    def is_loaded(self):
+        return self._module is not None
 
     @property
     def check_info(self):
         return self.module.check_info
 
+    @property
+    def check_names(self):
+        if self.is_loaded:
+            return sorted(self.module.check_info)
+        return sorted(self._code_cache.get(self.path).check_names)
+
     def __getitem__(self, key):
+        __tracebackhide__ = True
+        self.module  # load the check file, so that errors in it show up here
         return CheckWrapper(self, key)
 
+    def parsed(self, section, check_output, parse):
+        __tracebackhide__ = True
+        # Result of parse(), cached by section and output, so that the parse
+        # function runs only once for the inventory and the checks of all items.
+        # Like in Check_MK, all of them get the same parsed object.
+        try:
+            key = (section, check_output)
+            hash(key)
+        except TypeError:
+            return parse()
+
+        parsed = self._parsed.get(key, _NOT_PARSED)
+        if parsed is _NOT_PARSED:
+            parsed = parse()
+            self._parsed.put(key, parsed)
+        return parsed
+
+    def parse_cache_info(self):
+        return self._parsed.info()
+
 
 class CheckWrapper(object):
 
@@ -55,105 +134,260 @@ class CheckWrapper(object):
     def service_description(self):
         return self.check_info['service_description']
 
-    def inventory(self, check_output):
+    @property
+    def parse_function(self):
+        # Like in Check_MK, only the parse function of the main check of a section
+        # is used, for its subchecks as well
+        return self.check_file.check_info.get(self.section, {}).get('parse_function')
+
+    def inventory(self, check_output, budget=None):
         __tracebackhide__ = True
-        section, info = parse_info(check_output.strip())
-        if section != self.section:
-            raise ValueError('Wrong section name in test data: expected "{}", got "{}"'.format(self.section, section))
+        # budget (a pytest_check_mk.budget.Budget) overrides the one of the
+        # check file, as set by the checks fixture
+        info = self._get_parsed(check_output, budget)
 
         inventory_function = self.check_info['inventory_function']
-        return inventory_function(info)
+        return self._invoke(inventory_function, (info,), budget)
 
-    def check(self, item, params, check_output):
+    def check(self, item, params, check_output, budget=None):
         __tracebackhide__ = True
-        section, info = parse_info(check_output.strip())
-        if section != self.section:
-            raise ValueError('Wrong section name in test data: expected "{}", got "{}"'.format(self.section, section))
+        info = self._get_parsed(check_output, budget)
+        return self._invoke(self._check, (item, params, info), budget)
+
+    def check_many(self, check_output, items=None, budget=None):
+        __tracebackhide__ = True
+        # Checks all (item, params) pairs in items, or all items found by the
+        # inventory, against one output, which is parsed only once. Errors of
+        # single checks are collected in the result instead of being raised.
+        if self.parse_function is None:
+            info = self._get_info(check_output)
+        else:
+            info = self._get_parsed(check_output, budget)
+        copy = self.copy_parsed
+
+        if items is None:
+            inventory_function = self.check_info['inventory_function']
+            items = [(item, self._inventory_params(params))
+                     for item, params in self._invoke(inventory_function, (copy(info),), budget)]
+
+        # Results are keyed by item, a second params for an item would replace
+        # the result of the first one
+        counts = collections.Counter(item for item, _ in items)
+        duplicates = [item for item, count in counts.items() if count > 1]
+        if duplicates:
+            raise UsageError('check_many got items more than once: {}'.format(', '.join(map(repr, duplicates))))
+
+        results = collections.OrderedDict()
+        timings = collections.OrderedDict()
+        errors = collections.OrderedDict()
+        for item, params in items:
+            item_info = copy(info)
+            start = _clock()
+            try:
+                results[item] = self._invoke(self._check, (item, params, item_info), budget)
+            except (Exception, BudgetExceeded) as e:
+                errors[item] = e
+            finally:
+                timings[item] = _clock() - start
+        return CheckManyResult(results, timings, errors)
+
+    def check_parsed(self, item, params, parsed):
+        __tracebackhide__ = True
+        # Runs the check function on parsed as returned by parse(), without
+        # parsing, copying or a budget
+        return self._check(item, params, parsed)
 
+    def inventory_parsed(self, parsed):
+        __tracebackhide__ = True
+        return self.check_info['inventory_function'](parsed)
+
+    def copy_parsed(self, parsed):
+        # What every inventory and check call gets of the same parsed output: a
+        # copy of the info, or the result of the parse function itself
+        if self.parse_function is None:
+            return copy_info(parsed)
+        return _shared(parsed)
+
+    def _check(self, item, params, info):
+        __tracebackhide__ = True
         check_function = self.check_info['check_function']
         result = check_function(item, params, info)
         return self._convert_check_result(result)
 
+    def _invoke(self, function, args, budget, name=None):
+        __tracebackhide__ = True
+        # All calls into the check file go through here to enforce the budget
+        # and to profile them (by check plugin name) with --check-mk-profile
+        if budget is None:
+            budget = self.check_file.budget
+        profiler = self.check_file.profiler
+        if profiler is not None:
+            function = functools.partial(profiler.call, name or self.name, function)
+        if not budget:
+            return function(*args)
+        return budget.call(function, *args)
+
+    def _inventory_params(self, params):
+        # Inventory functions may return the name of a variable of the check
+        # file holding the default parameters
+        if isinstance(params, str):
+            namespace = vars(self.check_file.module)
+            if params in namespace:
+                return namespace[params]
+        return params
+
+    def inventory_per_host(self, agent_output):
+        __tracebackhide__ = True
+        # Inventory of this check for the monitored host (None) and every
+        # piggybacked host having its section in the agent output
+        return dict((host, self.inventory(index)) for host, index in self._host_indexes(agent_output))
+
+    def check_per_host(self, item, params, agent_output):
+        __tracebackhide__ = True
+        return dict((host, self.check(item, params, index)) for host, index in self._host_indexes(agent_output))
+
+    def _host_indexes(self, agent_output):
+        if not isinstance(agent_output, SectionIndex):
+            agent_output = parse_agent_output(agent_output)
+        return [(host, index) for host, index in agent_output.hosts() if self.section in index]
+
+    def parse(self, check_output):
+        __tracebackhide__ = True
+        # What the inventory and check functions get for check_output: the
+        # result of the parse function, or the info. Nothing is cached.
+        info = self._get_info(check_output, cached=False)
+        parse_function = self.parse_function
+        if parse_function is None:
+            return info
+        return parse_function(info)
+
+    def _get_parsed(self, check_output, budget=None):
+        __tracebackhide__ = True
+        parse_function = self.parse_function
+        if parse_function is None:
+            return self._get_info(check_output)
+        return self.check_file.parsed(self.section, check_output,
+                                      lambda: self._invoke(parse_function, (self._get_info(check_output),), budget,
+                                                           name=self.section))
+
+    def _get_info(self, check_output, cached=True):
+        __tracebackhide__ = True
+        # check_output is either the output of a single section or a SectionIndex
+        # of a complete agent output, as returned by parse_agent_output. Bytes
+        # (as returned by AgentWrapper.run) are parsed as a complete agent output.
+        if _is_bytes(check_output):
+            check_output = parse_agent_output(check_output)
+        if isinstance(check_output, SectionIndex):
+            if self.section not in check_output:
+                raise ValueError('Section "{}" not found in agent output'.format(self.section))
+            return check_output[self.section].copy_info()
+
+        section, info = (parse_info if cached else _parse_info)(check_output.strip())
+        if section != self.section:
+            raise ValueError('Wrong section name in test data: expected "{}", got "{}"'.format(self.section, section))
+        return info
+
     def _convert_check_result(self, result):
         __tracebackhide__ = True
         # Most of this function is taken from check_mk_base.convert_check_result,
-        # minus the snmp support (as this is not supported anyway as of now)
+        # minus the snmp support (as this is not supported anyway as of now).
+        # Subresults are consumed one at a time and their texts only joined when
+        # the text of the result is used.
         if type(result) == tuple:
             return result
-        else:
-            subresults = list(result)
-            if len(subresults) == 1:
-                return subresults[0]
-
-            perfdata = []
-            infotexts = []
-            status = 0
-
-            for subresult in subresults:
-                st, text = subresult[:2]
-                if text is not None:
-                    infotexts.append(text + ["", "(!)", "(!!)", "(?)"][st])
-                    if st == 2 or status == 2:
-                        status = 2
-                    else:
-                        status = max(status, st)
-                if len(subresult) == 3:
-                    perfdata += subresult[2]
-
-            return status, ", ".join(infotexts), perfdata
-
-
-def parse_info(check_output):
-    __tracebackhide__ = True
-    lines = check_output.splitlines(True)
-
-    section_name, section_options = parse_header(lines[0].strip())
-
-    try:
-        separator = chr(int(section_options['sep']))
-    except:
-        separator = None
-
-    output = []
-    for line in lines[1:]:
-        if is_header(line.strip()):
-            raise ValueError('Test data contains a second section header: {}'.format(line.strip()))
-        if 'nostrip' not in section_options:
-            line = line.strip()
-        output.append(line.split(separator))
-
-    return section_name, output
-
-
-def parse_header(header):
-    __tracebackhide__ = True
-
-    if not is_header(header):
-        raise ValueError('Invalid header in test data: {}'.format(header))
-
-    header_items = header[3:-3].split(':')
-    name = header_items[0]
-    section_options = {}
-    for option in header_items[1:]:
-        match = re.match('^([^\(]+)(?:\((.*)\))$', option)
-        if match:
-            key, value = match.groups()
-            section_options[key] = value
-        else:
-            raise ValueError('Invalid section option {}'.format(option))
 
-    return name, section_options
+        subresults = []
+        infotexts = []
+        perfdata = []
+        status = 0
+
+        for subresult in result:
+            subresults.append(subresult)
+            st, text = subresult[:2]
+            # Subresults with a text of None only add perfdata, their state
+            # does not count
+            if text is not None:
+                infotexts.append(text + _STATE_MARKERS[st])
+                if st == 2 or status == 2:
+                    status = 2
+                else:
+                    status = max(status, st)
+            if len(subresult) == 3:
+                perfdata += subresult[2]
+
+        if len(subresults) == 1:
+            return subresults[0]
+        return CheckResult(status, infotexts, perfdata, subresults)
+
+
+class CheckResult(object):
+    # Result of a check yielding several subresults. It compares equal to and
+    # can be used like the tuple (status, text, perfdata). The text is joined
+    # on first access, subresults are the subresults as yielded by the check.
+
+    __slots__ = ('status', 'perfdata', 'subresults', '_infotexts', '_text')
+
+    def __init__(self, status, infotexts, perfdata, subresults=()):
+        self.status = status
+        self.perfdata = perfdata
+        self.subresults = subresults
+        self._infotexts = infotexts
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = ', '.join(self._infotexts)
+            self._infotexts = None
+        return self._text
+
+    def _as_tuple(self):
+        return self.status, self.text, self.perfdata
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, index):
+        return self._as_tuple()[index]
+
+    def __iter__(self):
+        return iter(self._as_tuple())
 
+    def __eq__(self, other):
+        if isinstance(other, CheckResult):
+            other = other._as_tuple()
+        if not isinstance(other, tuple):
+            return NotImplemented
+        return self._as_tuple() == other
 
-def is_header(line):
-    __tracebackhide__ = True
-    return line.strip()[:3] == '<<<' and line.strip()[-3:] == '>>>'
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash((self.status, self.text, tuple(self.perfdata)))
+
+    def __repr__(self):
+        return 'CheckResult{!r}'.format(self._as_tuple())
+
+
+_STATE_MARKERS = ('', '(!)', '(!!)', '(?)')
+
+
+def _shared(parsed):
+    return parsed
 
 
 class AgentDirectoryWrapper(object):
 
+    def __init__(self):
+        self.used_paths = []
+
     def __getitem__(self, key):
-        return AgentWrapper(key)
+        agent = AgentWrapper(key)
+        if agent.path not in self.used_paths:
+            self.used_paths.append(agent.path)
+        return agent
 
 
 class AgentWrapper(object):
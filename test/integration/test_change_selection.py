@@ -0,0 +1,106 @@
+import stat
+import textwrap
+
+import pytest
+
+
+class Project(object):
+
+    def __init__(self, testdir):
+        self.checks_dir = testdir.mkdir('checks')
+        self.agents_dir = testdir.mkdir('agents')
+
+    def write_check(self, name, content):
+        self.checks_dir.join(name).write(textwrap.dedent(content))
+
+    def write_agent(self, name, output):
+        agent = self.agents_dir.join(name)
+        agent.write('#!/bin/sh\necho "{}"\n'.format(output))
+        agent.chmod(stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+
+
+@pytest.fixture
+def project(testdir):
+    project = Project(testdir)
+    project.write_check('first.include', '''
+        def first_helper():
+            return 1
+    ''')
+    project.write_check('first', '''
+        check_includes['first'] = ['first.include']
+        check_info['first'] = {}
+    ''')
+    project.write_check('second', '''
+        check_info['second'] = {}
+    ''')
+    project.write_agent('second_agent', 'foo')
+    testdir.makepyfile(test_first='''
+        test_for = 'first'
+
+        def test_first(checks):
+            assert checks.module.first_helper() == 1
+    ''', test_second='''
+        test_for = 'second'
+
+        def test_second(checks, agents):
+            assert 'second' in checks.check_info
+            agents['second_agent'].run()
+    ''')
+    return project
+
+
+def test_change_selection_deselects_unchanged_tests(testdir, project):
+    testdir.runpytest('--check-mk-changed').assert_outcomes(passed=2)
+
+    result = testdir.runpytest('--check-mk-changed')
+
+    result.assert_outcomes(deselected=2)
+
+
+def test_change_selection_runs_tests_of_changed_check(testdir, project):
+    testdir.runpytest('--check-mk-changed').assert_outcomes(passed=2)
+    project.write_check('second', '''
+        check_info['second'] = {'changed': True}
+    ''')
+
+    result = testdir.runpytest('--check-mk-changed', '-v')
+
+    result.assert_outcomes(passed=1, deselected=1)
+    result.stdout.fnmatch_lines('*test_second PASSED*')
+
+
+def test_change_selection_runs_tests_of_changed_include(testdir, project):
+    testdir.runpytest('--check-mk-changed').assert_outcomes(passed=2)
+    project.write_check('first.include', '''
+        def first_helper():
+            return 1  # changed
+    ''')
+
+    result = testdir.runpytest('--check-mk-changed', '-v')
+
+    result.assert_outcomes(passed=1, deselected=1)
+    result.stdout.fnmatch_lines('*test_first PASSED*')
+
+
+def test_change_selection_runs_tests_of_changed_agent(testdir, project):
+    testdir.runpytest('--check-mk-changed').assert_outcomes(passed=2)
+    project.write_agent('second_agent', 'bar')
+
+    result = testdir.runpytest('--check-mk-changed', '-v')
+
+    result.assert_outcomes(passed=1, deselected=1)
+    result.stdout.fnmatch_lines('*test_second PASSED*')
+
+
+def test_change_selection_reruns_failed_tests(testdir, project):
+    testdir.makepyfile(test_failing='''
+        test_for = 'second'
+
+        def test_failing(checks):
+            assert False
+    ''')
+    testdir.runpytest('--check-mk-changed').assert_outcomes(passed=2, failed=1)
+
+    result = testdir.runpytest('--check-mk-changed')
+
+    result.assert_outcomes(failed=1, deselected=2)
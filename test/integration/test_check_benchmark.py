@@ -0,0 +1,41 @@
+import json
+import textwrap
+
+
+def test_check_benchmark_compares_with_stored_baseline(testdir):
+    testdir.mkdir('checks').join('example').write(textwrap.dedent('''
+        def check_example(item, params, info):
+            return 0, ' '.join(line[0] for line in info)
+
+        check_info['example'] = {'check_function': check_example}
+    '''))
+    testdir.makepyfile('''
+        test_for = 'example'
+
+        def test_speed(checks, check_benchmark):
+            check_benchmark.check(checks['example'], None, None, '<<<example>>>\\na\\nb')
+    ''')
+
+    result = testdir.runpytest('--check-mk-benchmark-rounds=3')
+
+    assert result.ret == 0
+    result.stdout.fnmatch_lines([
+        '*check_mk benchmarks*',
+        'test_check_benchmark_compares_with_stored_baseline.py::test_speed::example::check: '
+        'parse * ns (p95 * ns), call * ns (p95 * ns)',
+    ])
+
+    baselines_file = testdir.tmpdir.join('.pytest_cache', 'v', 'check_mk', 'benchmarks')
+    baselines = json.loads(baselines_file.read())
+    for baseline in baselines.values():
+        baseline['call'] /= 1000.0
+    baselines_file.write(json.dumps(baselines))
+
+    result = testdir.runpytest('--check-mk-benchmark-rounds=3')
+
+    assert result.ret == 1
+    result.stdout.fnmatch_lines(['*::example::check: call *x regressed by more than 2.0x compared to the baseline'])
+
+    result = testdir.runpytest('--check-mk-benchmark-rounds=3', '--check-mk-benchmark-update')
+
+    assert result.ret == 0
@@ -0,0 +1,79 @@
+import pstats
+import textwrap
+
+
+def test_check_profile_writes_profiles_by_check_plugin(testdir):
+    testdir.mkdir('checks').join('example').write(textwrap.dedent('''
+        def parse_example(info):
+            return dict((line[0], int(line[1])) for line in info)
+
+        def inventory_example(parsed):
+            for item in sorted(parsed):
+                yield item, None
+
+        def check_example(item, params, parsed):
+            return 0, 'value %d' % parsed[item]
+
+        def check_example_sum(item, params, parsed):
+            return 0, 'sum %d' % sum(parsed.values())
+
+        check_info['example'] = {
+            'parse_function': parse_example,
+            'inventory_function': inventory_example,
+            'check_function': check_example,
+        }
+        check_info['example.sum'] = {
+            'check_function': check_example_sum,
+        }
+    '''))
+    testdir.makepyfile('''
+        test_for = 'example'
+
+        OUTPUT = '<<<example>>>\\na 1\\nb 2'
+
+        def test_inventory(checks):
+            assert list(checks['example'].inventory(OUTPUT)) == [('a', None), ('b', None)]
+            assert checks['example'].check('a', None, OUTPUT) == (0, 'value 1')
+
+        def test_sum(checks):
+            assert checks['example.sum'].check(None, None, OUTPUT) == (0, 'sum 3')
+    ''')
+
+    result = testdir.runpytest('--check-mk-profile', '--check-mk-profile-dir=prof', '--check-mk-profile-top=3')
+
+    assert result.ret == 0
+    result.stdout.fnmatch_lines([
+        '*check_mk profile*',
+        '*s self *s total * calls  example*: *checks?example:*',
+        '*s self *s total * calls  example*: *checks?example:*',
+        '*s self *s total * calls  example*: *checks?example:*',
+        '2 profiles written to prof',
+    ])
+    assert sorted(path.basename for path in testdir.tmpdir.join('prof').listdir()) == [
+        'example.collapsed', 'example.pstats', 'example.sum.collapsed', 'example.sum.pstats']
+
+    # The parse function counts for the main check of the section
+    functions = [function[2] for function in pstats.Stats(str(testdir.tmpdir.join('prof', 'example.pstats'))).stats]
+    assert 'parse_example' in functions
+    assert 'check_example_sum' not in functions
+    collapsed = testdir.tmpdir.join('prof', 'example.sum.collapsed').read()
+    assert '(check_example_sum)' in collapsed
+
+
+def test_check_profile_is_off_by_default(testdir):
+    testdir.mkdir('checks').join('example').write(textwrap.dedent('''
+        check_info['example'] = {'check_function': lambda item, params, info: (0, 'ok')}
+    '''))
+    testdir.makepyfile('''
+        test_for = 'example'
+
+        def test_check(checks):
+            assert checks.profiler is None
+            checks['example'].check(None, None, '<<<example>>>\\na')
+    ''')
+
+    result = testdir.runpytest()
+
+    assert result.ret == 0
+    assert 'check_mk profile' not in result.stdout.str()
+    assert not testdir.tmpdir.join('check_mk_profile').check()
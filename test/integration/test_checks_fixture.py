@@ -64,3 +64,208 @@ def test_check_calls_parse_info(testdir, example_check, mocker):
 
     pytest_check_mk.wrapper.parse_info.assert_called_once_with('<<<example>>>\na b')
     assert result.ret == 0
+
+
+def test_checks_fixture_isolates_module_state_between_tests(testdir, example_check):
+    example_check('''
+        counter = []
+    ''')
+    testdir.makepyfile('''
+        import pytest
+
+        test_for = 'example'
+
+        @pytest.mark.parametrize('run', range(3))
+        def test_foo(checks, run):
+            assert checks.module.counter == []
+            checks.module.counter.append(run)
+    ''')
+
+    result = testdir.runpytest()
+
+    assert result.ret == 0
+
+
+@pytest.mark.parametrize('extra_args, expect_bytecode', [
+    ([], True),
+    (['--check-mk-no-bytecode-cache'], False),
+])
+def test_checks_fixture_stores_bytecode_in_pytest_cache(testdir, example_check, extra_args, expect_bytecode):
+    example_check('''
+        check_info['example'] = {}
+    ''')
+    testdir.makepyfile('''
+        test_for = 'example'
+
+        def test_foo(checks):
+            assert 'example' in checks.check_info
+    ''')
+
+    result = testdir.runpytest(*extra_args)
+
+    assert result.ret == 0
+    bytecode_dir = testdir.tmpdir.join('.pytest_cache', 'd', 'check_mk_bytecode')
+    assert (bytecode_dir.check() and len(bytecode_dir.listdir()) == 1) == expect_bytecode
+
+
+@pytest.mark.parametrize('extra_args', [[], ['--check-mk-no-module-reuse']])
+def test_checks_fixture_resets_changed_globals_between_tests(testdir, example_check, extra_args):
+    example_check('''
+        factory_settings['example_default_levels'] = {'levels': (80, 90)}
+        check_info['example'] = {'service_description': 'Example'}
+    ''')
+    testdir.makepyfile('''
+        import pytest
+
+        test_for = 'example'
+
+        @pytest.mark.parametrize('run', range(3))
+        def test_foo(checks, run):
+            assert checks.module.factory_settings['example_default_levels'] == {'levels': (80, 90)}
+            assert checks['example'].service_description == 'Example'
+            assert not hasattr(checks.module, 'new_global')
+
+            checks.module.factory_settings['example_default_levels']['levels'] = (1, 2)
+            checks.check_info['example']['service_description'] = 'Changed'
+            checks.module.new_global = run
+    ''')
+
+    result = testdir.runpytest(*extra_args)
+
+    assert result.ret == 0
+
+
+@pytest.mark.parametrize('extra_args', [[], ['--check-mk-no-module-reuse']])
+def test_checks_fixture_resets_function_and_class_state_between_tests(testdir, example_check, extra_args):
+    example_check('''
+        class State(object):
+            count = 0
+
+        def make_total():
+            values = []
+            def total(value):
+                values.append(value)
+                return sum(values)
+            return total
+
+        total = make_total()
+
+        def check_example(item, params, info, _seen=[]):
+            _seen.append(item)
+            State.count += 1
+            check_example.calls = getattr(check_example, 'calls', 0) + 1
+            return 0, '%d %d %d %d' % (len(_seen), State.count, check_example.calls, total(1))
+
+        check_info['example'] = {'check_function': check_example}
+    ''')
+    testdir.makepyfile('''
+        import pytest
+
+        test_for = 'example'
+
+        @pytest.mark.parametrize('run', range(3))
+        def test_foo(checks, run):
+            assert checks['example'].check('a', None, '<<<example>>>\\na') == (0, '1 1 1 1')
+    ''')
+
+    result = testdir.runpytest(*extra_args)
+
+    assert result.ret == 0
+
+
+def test_checks_fixture_executes_check_file_on_first_use(testdir, example_check):
+    example_check('''
+        check_info['example'] = {}
+        check_info['example.bar'] = {}
+        raise RuntimeError('check file executed')
+    ''')
+    testdir.makepyfile('''
+        test_for = 'example'
+
+        def test_metadata_only(checks):
+            assert checks.check_names == ['example', 'example.bar']
+
+        def test_unused(checks):
+            pass
+
+        def test_check(checks):
+            checks['example']
+    ''')
+
+    result = testdir.runpytest()
+
+    result.assert_outcomes(passed=2, failed=1)
+    result.stdout.fnmatch_lines('''
+        *RuntimeError: check file executed
+    ''')
+
+
+def test_checks_fixture_precompiles_checks_directory(testdir, example_check):
+    example_check('''
+        check_info['example'] = {}
+    ''')
+    testdir.tmpdir.join('checks', 'broken').write('print("foo\n')
+    testdir.makepyfile('''
+        test_for = 'example'
+
+        def test_foo(checks):
+            assert 'example' in checks.check_info
+    ''')
+
+    result = testdir.runpytest('--check-mk-precompile')
+
+    assert result.ret == 0
+    result.stdout.fnmatch_lines('''
+        check_mk: precompiled 2 files from checks, 1 failed
+            checks/broken: SyntaxError*
+    ''')
+
+
+@pytest.fixture
+def endless_check(example_check):
+    example_check('''
+        def check_example(item, params, info):
+            while True:
+                pass
+
+        check_info['example'] = {'check_function': check_example, 'inventory_function': lambda info: []}
+    ''')
+
+
+def test_check_budget_from_command_line(testdir, endless_check):
+    testdir.makepyfile('''
+        test_for = 'example'
+
+        def test_foo(checks):
+            assert checks['example'].inventory('<<<example>>>') == []
+            checks['example'].check(None, None, '<<<example>>>')
+    ''')
+
+    result = testdir.runpytest('--check-mk-timeout=0.2')
+
+    assert result.ret == 1
+    result.stdout.fnmatch_lines([
+        '*BudgetExceeded: Check exceeded its wall clock budget of 0.2s, stopped at:',
+        '*in check_example',
+    ])
+
+
+@pytest.mark.parametrize('isolated', [False, True])
+def test_check_budget_from_marker_overrides_command_line(testdir, endless_check, isolated):
+    testdir.makepyfile('''
+        import pytest
+        from pytest_check_mk import BudgetExceeded
+
+        test_for = 'example'
+
+        @pytest.mark.check_mk_budget(cpu=0.2, isolated={})
+        def test_foo(checks):
+            assert checks.budget.wall == 60
+            with pytest.raises(BudgetExceeded) as exc:
+                checks['example'].check(None, None, '<<<example>>>')
+            assert exc.value.kind == 'CPU'
+    '''.format(isolated))
+
+    result = testdir.runpytest('--check-mk-timeout=60')
+
+    assert result.ret == 0
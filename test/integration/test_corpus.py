@@ -0,0 +1,58 @@
+import textwrap
+
+import pytest
+
+
+@pytest.fixture
+def corpus_project(testdir):
+    testdir.mkdir('checks').join('example').write(textwrap.dedent('''
+        def inventory_example(info):
+            return [(line[0], None) for line in info]
+
+        def check_example(item, params, info):
+            for line in info:
+                if line[0] == item:
+                    return int(line[1]), 'value ' + line[1]
+
+        check_info['example'] = {
+            'inventory_function': inventory_example,
+            'check_function': check_example,
+            'service_description': 'Example %s',
+        }
+    '''))
+    dumps = testdir.mkdir('dumps')
+    dumps.join('host1').write('<<<example>>>\na 0\nb 1\n')
+    dumps.join('host2').write('<<<other>>>\nx\n')
+    dumps.join('host3').write('<<<example>>>\na 7\n')
+    dumps.mkdir('site').join('host4').write('<<<check_mk>>>\nVersion: 1.2.8\n<<<example>>>\nc 2\n')
+    testdir.makepyfile('''
+        test_for = 'example'
+
+        def test_corpus(corpus):
+            report = corpus.run()
+            assert [result.path for result in report.failed] == ['dumps/host3']
+            assert len(report.passed) == 2
+            assert [result.path for result in report.skipped] == ['dumps/host2']
+            assert report.throughput > 0
+    ''')
+    return testdir
+
+
+@pytest.mark.parametrize('processes', ['1', '2'])
+def test_corpus_runs_checks_on_all_agent_outputs(corpus_project, processes):
+    result = corpus_project.runpytest('--check-mk-corpus=dumps', '--check-mk-corpus-processes=' + processes)
+
+    assert result.ret == 0
+    result.stdout.fnmatch_lines([
+        '*check_mk corpus*',
+        'example: 4 outputs, 2 passed, 1 failed, 1 skipped in *s (* outputs/s)',
+        '    FAILED dumps/host3: *AssertionError*',
+        '    slowest outputs:',
+    ])
+
+
+def test_corpus_is_skipped_without_directory(corpus_project):
+    result = corpus_project.runpytest('-rs')
+
+    result.assert_outcomes(skipped=1)
+    result.stdout.fnmatch_lines(['*No corpus of agent outputs given*'])
@@ -97,3 +97,234 @@ def test_check_module_from_source_contains_variables(example_check):
 
     assert hasattr(module, 'some_value')
     assert module.some_value == 5
+
+
+def test_code_cache_compiles_unchanged_file_only_once(example_check):
+    path = example_check('''
+        some_value = 5
+    ''')
+    code_cache = file_loader.CodeCache()
+
+    assert code_cache.get_code(path) is code_cache.get_code(path)
+
+
+def test_code_cache_recompiles_changed_file(example_check):
+    path = example_check('''
+        some_value = 5
+    ''')
+    code_cache = file_loader.CodeCache()
+    first_code = code_cache.get_code(path)
+
+    example_check('''
+        some_value = 6
+    ''')
+
+    assert code_cache.get_code(path) is not first_code
+    assert file_loader.check_module_from_source('foo', path, code_cache=code_cache).some_value == 6
+
+
+def test_check_module_from_source_with_code_cache_returns_fresh_namespace(example_check):
+    path = example_check('''
+        check_info['foo.bar'] = {'key': 'value'}
+    ''')
+    code_cache = file_loader.CodeCache()
+
+    first = file_loader.check_module_from_source('foo', path, code_cache=code_cache)
+    first.check_info['foo.bar']['key'] = 'changed'
+    first.some_value = 42
+    second = file_loader.check_module_from_source('foo', path, code_cache=code_cache)
+
+    assert second.check_info['foo.bar'] == {'key': 'value'}
+    assert not hasattr(second, 'some_value')
+
+
+def test_code_cache_loads_bytecode_from_directory_without_compiling(example_check, tmpdir, mocker):
+    path = example_check('''
+        some_value = 5
+    ''')
+    directory = str(tmpdir.mkdir('bytecode'))
+    file_loader.CodeCache(directory=directory).get_code(path)
+
+    mock_compile = mocker.patch('pytest_check_mk.file_loader.compile', create=True)
+    code = file_loader.CodeCache(directory=directory).get_code(path)
+
+    assert not mock_compile.called
+    namespace = {}
+    exec(code, namespace)
+    assert namespace['some_value'] == 5
+
+
+def test_code_cache_ignores_bytecode_with_wrong_magic_number(example_check, tmpdir):
+    path = example_check('''
+        some_value = 5
+    ''')
+    directory = tmpdir.mkdir('bytecode')
+    file_loader.CodeCache(directory=str(directory)).get_code(path)
+    for cache_file in directory.listdir():
+        cache_file.write_binary(b'\0\0\0\0garbage')
+
+    code = file_loader.CodeCache(directory=str(directory)).get_code(path)
+
+    namespace = {}
+    exec(code, namespace)
+    assert namespace['some_value'] == 5
+
+
+def test_check_modules_do_not_share_registries(example_check):
+    path = example_check('''
+        check_info['foo.bar'] = {}
+        check_config_variables.append('another_item')
+    ''')
+    first = file_loader.check_module_from_source('foo', path)
+    second = file_loader.check_module_from_source('foo', path)
+
+    for name, _ in file_loader._REGISTRIES:
+        assert getattr(first, name) is not getattr(second, name)
+    assert second.check_config_variables == ['another_item']
+
+
+def test_check_module_from_source_contains_header_helpers(example_check):
+    path = example_check('''
+        pattern = regex('^foo')
+    ''')
+
+    module = file_loader.check_module_from_source('foo', path)
+
+    assert module.pattern.match('foobar')
+    assert module.time.time() > 0
+
+
+@pytest.fixture
+def include_file(tmpdir):
+    def fill_file(name, content):
+        include = tmpdir.join('checks', name)
+        include.write(textwrap.dedent(content))
+        return str(include)
+
+    return fill_file
+
+
+@pytest.mark.parametrize('source, expected_includes', [
+    ('', []),
+    ('check_includes["foo"] = ["foo.include"]', ['foo.include']),
+    ('check_includes["foo"] = ["foo.include", "bar.include"]', ['foo.include', 'bar.include']),
+    ('check_info["foo"] = {"check_function": check_foo, "includes": ["foo.include"]}', ['foo.include']),
+    ('check_includes["foo"] = ["foo.include"]\ncheck_includes["foo.bar"] = ["foo.include"]', ['foo.include']),
+    ('check_includes["foo"] = get_includes()', []),
+    ('factory_settings["foo_default_levels"] = {"includes": ["*.log"]}', []),
+    ('check_info["foo"] = {"default_levels_variable": {"includes": ["x"]}, "includes": ["foo.include"]}',
+     ['foo.include']),
+    ('params = {"includes": ["x"]}\ncheck_info["foo"] = {"includes": ["foo.include"]}', ['foo.include']),
+])
+def test_find_includes(source, expected_includes):
+    import ast
+
+    assert file_loader.find_includes(ast.parse(source)) == expected_includes
+
+
+def test_check_module_from_source_executes_includes_first(example_check, include_file):
+    include_file('base.include', '''
+        def base_function():
+            return 'base'
+    ''')
+    include_file('foo.include', '''
+        check_includes['foo.include'] = ['base.include']
+
+        def foo_function():
+            return base_function() + ' foo'
+    ''')
+    path = example_check('''
+        value = foo_function()
+        check_includes['foo'] = ['foo.include']
+    ''')
+
+    module = file_loader.check_module_from_source('foo', path)
+
+    assert module.value == 'base foo'
+
+
+def test_check_module_from_source_fails_on_missing_include(example_check):
+    path = example_check('''
+        check_includes['foo'] = ['missing.include']
+    ''')
+
+    with pytest.raises(MissingFileError):
+        file_loader.check_module_from_source('foo', path)
+
+
+def test_code_cache_shares_compiled_includes_and_knows_dependents(example_check, include_file, tmpdir):
+    include = include_file('foo.include', '''
+        def foo_function():
+            pass
+    ''')
+    first = include_file('first', '''
+        check_includes['first'] = ['foo.include']
+    ''')
+    second = include_file('second', '''
+        check_info['second'] = {'includes': ['foo.include']}
+    ''')
+    unrelated = example_check('')
+    code_cache = file_loader.CodeCache()
+
+    first_order = code_cache.load_order(first)
+    second_order = code_cache.load_order(second)
+    code_cache.load_order(unrelated)
+
+    assert [f.path for f in first_order] == [include, first]
+    assert first_order[0] is second_order[0]
+    assert code_cache.dependents(include) == set([first, second])
+    assert code_cache.dependents(first) == set()
+
+
+@pytest.mark.parametrize('source, expected_check_names', [
+    ('', []),
+    ('check_info["foo"] = {}', ['foo']),
+    ('check_info["foo"] = {}\ncheck_info["foo.bar"] = {}\ncheck_info["foo"] = {}', ['foo', 'foo.bar']),
+    ('check_info[name] = {}', []),
+    ('other_info["foo"] = {}', []),
+])
+def test_find_check_names(source, expected_check_names):
+    import ast
+
+    assert file_loader.find_check_names(ast.parse(source)) == expected_check_names
+
+
+def test_find_check_files(tmpdir, monkeypatch):
+    checks_dir = tmpdir.mkdir('checks')
+    for name in ['foo', 'foo.include', '.hidden', 'bar~']:
+        checks_dir.join(name).write('')
+    checks_dir.mkdir('subdir')
+    monkeypatch.chdir(tmpdir)
+
+    assert file_loader.find_check_files() == ['checks/foo', 'checks/foo.include']
+
+
+def test_find_check_files_without_checks_directory(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+
+    assert file_loader.find_check_files() == []
+
+
+def test_code_cache_precompile_fills_cache_and_reports_errors(example_check, include_file, tmpdir, mocker):
+    path = example_check('''
+        check_includes['foo'] = ['foo.include']
+    ''')
+    include = include_file('foo.include', '''
+        value = 5
+    ''')
+    broken = include_file('broken', '''
+        print("foo
+    ''')
+    directory = tmpdir.mkdir('bytecode')
+    code_cache = file_loader.CodeCache(directory=str(directory))
+
+    errors = code_cache.precompile([path, include, broken], processes=2)
+
+    assert [error_path for error_path, _ in errors] == [broken]
+    assert 'SyntaxError' in errors[0][1]
+    assert len(directory.listdir()) == 2
+
+    mock_compile = mocker.patch('pytest_check_mk.file_loader.compile', create=True)
+    assert file_loader.check_module_from_source('foo', path, code_cache=code_cache).value == 5
+    assert file_loader.check_module_from_source('foo', path, code_cache=file_loader.CodeCache(str(directory)))
+    assert not mock_compile.called
@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+import pytest
+
+
+def _imports_of(statement, setup):
+    # Modules imported by statement as reported by `python -X importtime`,
+    # excluding those already imported by setup
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', '{}; print("---"); {}'.format(setup, statement)],
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    after_setup = output.split('---\n', 1)[1]
+    return [line.rsplit('|', 1)[1].strip() for line in after_setup.splitlines() if line.startswith('import time:')]
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime requires Python 3.7')
+def test_plugin_import_does_not_load_fixture_implementation():
+    imports = _imports_of('import pytest_check_mk.plugin', setup='import pytest')
+
+    # Neither the package nor the plugin import anything else, the version
+    # (which runs git) included
+    assert imports == ['pytest_check_mk', 'pytest_check_mk.plugin']
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='module __getattr__ requires Python 3.7')
+def test_version_is_looked_up_on_first_access():
+    imports = _imports_of('import pytest_check_mk; print(pytest_check_mk.__version__)', setup='import pytest')
+
+    assert imports[0] == 'pytest_check_mk'
+    assert 'pytest_check_mk._version' in imports
@@ -0,0 +1,92 @@
+import sys
+import textwrap
+
+import pytest
+
+from pytest_check_mk import watch
+
+
+@pytest.fixture
+def project(testdir):
+    testdir.mkdir('checks')
+    testdir.tmpdir.join('checks', 'first').write("check_info['first'] = {}\n")
+    testdir.tmpdir.join('checks', 'second').write("check_info['second'] = {}\n")
+    for name in ['first', 'second']:
+        testdir.makepyfile(**{'test_watched_' + name: textwrap.dedent('''
+            test_for = '{0}'
+
+            def test_{0}(checks):
+                assert '{0}' in checks.check_info
+        '''.format(name))})
+
+    yield testdir
+
+    # The test runs of the watcher happen in this process
+    for name in ['test_watched_first', 'test_watched_second']:
+        sys.modules.pop(name, None)
+
+
+def test_watcher_runs_only_tests_affected_by_changed_check(project):
+    watcher = watch.Watcher(project.parseconfigure(str(project.tmpdir)))
+    assert watcher.run(watcher.test_paths) == 0
+    project.tmpdir.join('checks', 'second').write("check_info['second'] = {'changed': True}\n")
+
+    changed = watcher.changed_files()
+
+    assert changed == set([str(project.tmpdir.join('checks', 'second'))])
+    assert watcher.affected_tests(changed) == [str(project.tmpdir.join('test_watched_second.py::test_second'))]
+    assert watcher.changed_files() == set()
+
+
+def test_watcher_runs_all_tests_for_unknown_python_file(project):
+    watcher = watch.Watcher(project.parseconfigure(str(project.tmpdir)))
+    watcher.run(watcher.test_paths)
+    project.makeconftest('')
+
+    assert watcher.affected_tests(watcher.changed_files()) is None
+
+
+def test_watcher_reuses_check_modules_between_runs(project):
+    watcher = watch.Watcher(project.parseconfigure(str(project.tmpdir)))
+    watcher.run(watcher.test_paths)
+    code_cache = watcher._session_plugin.code_cache
+
+    watcher.run(watcher.test_paths)
+
+    assert code_cache is not None
+    assert watcher._session_plugin.code_cache is code_cache
+
+
+def test_watch_reruns_affected_tests_until_interrupted(project, mocker, capsys):
+    config = project.parseconfigure(str(project.tmpdir), '--check-mk-watch')
+    run = mocker.patch.object(watch.Watcher, 'run', autospec=True, side_effect=watch.Watcher.run)
+    changes = iter([
+        lambda: project.tmpdir.join('checks', 'first').write("check_info['first'] = {'changed': True}\n"),
+    ])
+
+    def sleep(interval):
+        try:
+            next(changes)()
+        except StopIteration:
+            raise KeyboardInterrupt()
+
+    assert watch.watch(config, sleep=sleep) == 0
+
+    run_args = [call[0][1] for call in run.call_args_list]
+    assert len(run_args) == 2
+    assert run_args[0][-1] == str(project.tmpdir)
+    assert run_args[1][-1] == str(project.tmpdir.join('test_watched_first.py::test_first'))
+    assert '--check-mk-watch' not in run_args[0] + run_args[1]
+    assert 'check_mk watch: 1 file(s) changed, running 1 test(s)\n' in capsys.readouterr().out
+
+
+def test_watch_stops_when_a_run_is_interrupted(project, mocker):
+    config = project.parseconfigure(str(project.tmpdir), '--check-mk-watch')
+    run = mocker.patch.object(watch.Watcher, 'run', side_effect=[0, watch._INTERRUPTED])
+
+    def sleep(interval):
+        # Without recorded dependencies, changing an unknown Python file runs all tests
+        project.makeconftest('')
+
+    assert watch.watch(config, sleep=sleep) == watch._INTERRUPTED
+    assert run.call_count == 2
@@ -1,3 +1,4 @@
+import fnmatch
 import sys
 
 import pytest
@@ -131,3 +132,31 @@ def test_assert_well_formed_perfdata_entry_lives_for_correct_entry(entry):
 def test_assert_well_formed_perfdata_entry_fails_for_wrong_entry(entry):
     with pytest.raises(AssertionError):
         assertions.assert_well_formed_perfdata_entry(entry)
+
+
+def test_assert_memory_below_returns_usage():
+    pytest.importorskip('tracemalloc')
+
+    usage = assertions.assert_memory_below(lambda count: 'x' * count, (1000,), peak=10000, retained=10000)
+
+    assert usage.result == 'x' * 1000
+    assert 1000 <= usage.retained <= usage.peak
+
+
+@pytest.mark.parametrize('limits, message', [
+    ({'peak': 1000}, 'peak memory * bytes exceeds 1000 bytes'),
+    ({'retained': 1000}, 'retained memory * bytes exceeds 1000 bytes'),
+])
+def test_assert_memory_below_lists_allocation_sites(limits, message):
+    pytest.importorskip('tracemalloc')
+
+    def allocate(count):
+        return ['x' * 100 + str(i) for i in range(count)]
+
+    with pytest.raises(AssertionError) as exc:
+        assertions.assert_memory_below(allocate, (1000,), **limits)
+
+    lines = str(exc.value).splitlines()
+    assert fnmatch.fnmatch(lines[0], message)
+    assert lines[1] == 'Top allocation sites at the peak:'
+    assert lines[2].startswith('    {}:{}: size='.format(__file__, allocate.__code__.co_firstlineno + 1))
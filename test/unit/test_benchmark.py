@@ -0,0 +1,124 @@
+import pytest
+
+from pytest_check_mk import benchmark, wrapper
+
+
+class FakeCache(object):
+
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    def get(self, key, default):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+@pytest.fixture
+def check(mocker):
+    module = mocker.Mock()
+    module.check_info = {
+        'foo': {
+            'parse_function': lambda info: dict((line[0], line[1:]) for line in info),
+            'inventory_function': lambda parsed: ((item, None) for item in parsed),
+            'check_function': lambda item, params, parsed: (0, ' '.join(parsed[item])),
+        },
+    }
+    return wrapper.CheckFileWrapper('foo', module)['foo']
+
+
+def make_benchmark(**kwargs):
+    return benchmark.CheckBenchmark('test_foo', rounds=5, min_round_time=0.001, **kwargs)
+
+
+def test_measure_calibrates_calls_per_round():
+    timing = make_benchmark().measure(lambda: sum(range(100)))
+
+    assert timing.rounds == 5
+    assert timing.calls > 1
+    assert 0 < timing.median_ns <= timing.p95_ns
+
+
+@pytest.mark.parametrize('kind, run', [
+    ('check', lambda bench, check: bench.check(check, 'a', None, '<<<foo>>>\na 1 2\nb 3')),
+    ('inventory', lambda bench, check: bench.inventory(check, '<<<foo>>>\na 1 2\nb 3')),
+])
+def test_benchmark_times_parse_and_call_and_stores_baseline(check, kind, run):
+    cache = FakeCache()
+    bench = make_benchmark(cache=cache)
+
+    result = run(bench, check)
+
+    assert result.key == 'test_foo::foo::' + kind
+    assert result.parse.median_ns > 0
+    assert result.call.median_ns > 0
+    assert result.baseline is None
+    assert bench.results == [result]
+    assert cache.values[benchmark.CACHE_KEY] == {
+        result.key: {'parse': result.parse.median_ns, 'call': result.call.median_ns},
+    }
+
+
+def test_benchmark_fails_on_regression(check):
+    cache = FakeCache({benchmark.CACHE_KEY: {'test_foo::foo::check': {'parse': 1e9, 'call': 0.001}}})
+
+    with pytest.raises(pytest.fail.Exception) as exc:
+        make_benchmark(cache=cache).check(check, 'a', None, '<<<foo>>>\na 1')
+
+    assert 'test_foo::foo::check: call' in str(exc.value)
+    assert 'regressed by more than 2.0x' in str(exc.value)
+    assert 'parse' not in str(exc.value).split(':')[-1]
+    assert cache.values[benchmark.CACHE_KEY]['test_foo::foo::check']['call'] == 0.001
+
+
+def test_benchmark_updates_baseline_on_request(check):
+    cache = FakeCache({benchmark.CACHE_KEY: {'test_foo::foo::check': {'parse': 1e9, 'call': 0.001}}})
+
+    result = make_benchmark(cache=cache, update=True).check(check, 'a', None, '<<<foo>>>\na 1', label='custom')
+    result = make_benchmark(cache=cache, update=True).check(check, 'a', None, '<<<foo>>>\na 1')
+
+    assert result.ratios()['parse'] < 1
+    assert 'parse 0.00x baseline' in result.summary_line()
+    assert cache.values[benchmark.CACHE_KEY]['test_foo::foo::check']['call'] == result.call.median_ns
+    assert 'custom::foo::check' in cache.values[benchmark.CACHE_KEY]
+
+
+def test_repeated_benchmarks_of_a_test_get_keys_of_their_own(check):
+    cache = FakeCache()
+    bench = make_benchmark(cache=cache)
+
+    small = bench.check(check, 'a', None, '<<<foo>>>\na 1')
+    large = bench.check(check, 'a', None, '<<<foo>>>\n' + 'a 1\n' * 1000)
+
+    assert small.key == 'test_foo::foo::check'
+    assert large.key == 'test_foo::foo::check#2'
+    assert large.baseline is None
+    assert sorted(cache.values[benchmark.CACHE_KEY]) == ['test_foo::foo::check', 'test_foo::foo::check#2']
+
+
+def test_repeated_label_is_a_usage_error(check):
+    bench = make_benchmark()
+    bench.check(check, 'a', None, '<<<foo>>>\na 1', label='small')
+
+    with pytest.raises(pytest.UsageError) as exc:
+        bench.check(check, 'a', None, '<<<foo>>>\na 1', label='small')
+
+    assert "label 'small' is used more than once for small::foo::check" in str(exc.value)
+
+
+def test_check_changing_its_info_gets_a_copy_in_every_call(mocker):
+    module = mocker.Mock()
+    module.check_info = {
+        'foo': {
+            'inventory_function': lambda info: [(info.pop(0)[0], None)],
+            'check_function': lambda item, params, info: (0, info.pop(0)[0]),
+        },
+    }
+    check = wrapper.CheckFileWrapper('foo', module)['foo']
+    bench = make_benchmark()
+
+    bench.check(check, 'a', None, '<<<foo>>>\na\nb')
+    bench.inventory(check, '<<<foo>>>\na')
+
+    assert check.check_parsed('a', None, check.parse('<<<foo>>>\na\nb')) == (0, 'a')
@@ -0,0 +1,153 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from pytest_check_mk import BudgetExceeded
+from pytest_check_mk.budget import Budget
+
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, 'setitimer') or not hasattr(os, 'fork'),
+                                reason='budgets need setitimer and fork')
+
+
+def spin():
+    while True:
+        pass
+
+
+def stuck():
+    # Like a function stuck in C code, which never handles the signals of the
+    # in-process timers
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM, signal.SIGPROF])
+    spin()
+
+
+@pytest.mark.parametrize('isolated', [False, True])
+@pytest.mark.parametrize('budget_args, kind', [
+    ({'wall': 0.1}, 'wall clock'),
+    ({'cpu': 0.1}, 'CPU'),
+])
+def test_budget_interrupts_function_with_stack(budget_args, kind, isolated):
+    with pytest.raises(BudgetExceeded) as exc:
+        Budget(isolated=isolated, **budget_args).call(spin)
+
+    assert exc.value.kind == kind
+    assert exc.value.limit == 0.1
+    assert 'in spin' in exc.value.stack
+    assert 'Check exceeded its {} budget of 0.1s'.format(kind) in str(exc.value)
+
+
+def swallow_exceptions():
+    while True:
+        try:
+            time.sleep(0.01)
+        except Exception:
+            pass
+
+
+def swallow_everything():
+    while True:
+        try:
+            time.sleep(0.001)
+        except:  # noqa: E722
+            pass
+        # An interrupt can only get out of the loop from here
+        deadline = time.time() + 0.01
+        while time.time() < deadline:
+            pass
+
+
+@pytest.mark.parametrize('function', [swallow_exceptions, swallow_everything])
+def test_budget_interrupts_function_catching_exceptions(function):
+    start = time.time()
+    with pytest.raises(BudgetExceeded) as exc:
+        Budget(wall=0.1).call(function)
+
+    assert time.time() - start < 1
+    assert 'in {}'.format(function.__name__) in exc.value.stack
+
+
+def test_budget_raises_after_function_swallowed_the_interrupt():
+    def swallow_once():
+        try:
+            time.sleep(0.5)
+        except:  # noqa: E722
+            return 'done'
+
+    with pytest.raises(BudgetExceeded) as exc:
+        Budget(wall=0.1).call(swallow_once)
+
+    assert 'in swallow_once' in exc.value.stack
+
+
+def test_budget_interrupts_sleeping_function():
+    start = time.time()
+    with pytest.raises(BudgetExceeded):
+        Budget(wall=0.1).call(time.sleep, 5)
+
+    assert time.time() - start < 1
+
+
+@pytest.mark.skipif(not hasattr(signal, 'pthread_sigmask'), reason='needs pthread_sigmask')
+@pytest.mark.parametrize('budget_args, kind', [
+    ({'wall': 0.1}, 'wall clock'),
+    ({'cpu': 0.1}, 'CPU'),
+])
+def test_isolated_budget_kills_stuck_function(budget_args, kind):
+    pytest.importorskip('faulthandler')
+    with pytest.raises(BudgetExceeded) as exc:
+        Budget(isolated=True, **budget_args).call(stuck)
+
+    assert exc.value.kind == kind
+    assert 'in stuck' in exc.value.stack
+
+
+@pytest.mark.parametrize('isolated', [False, True])
+def test_budget_returns_result_and_consumes_generators(isolated):
+    budget = Budget(wall=1, isolated=isolated)
+
+    assert budget.call(lambda a, b: (a, b), 0, 'ok') == (0, 'ok')
+    assert budget.call(lambda: (i for i in range(3))) == [0, 1, 2]
+
+
+@pytest.mark.parametrize('isolated', [False, True])
+def test_budget_passes_exceptions(isolated):
+    with pytest.raises(KeyError):
+        Budget(wall=1, isolated=isolated).call(lambda: {}['x'])
+
+
+def test_isolated_budget_reports_result_that_cannot_be_pickled():
+    with pytest.raises(RuntimeError) as exc:
+        Budget(wall=1, isolated=True).call(lambda: {'lock': threading.Lock()})
+
+    message = str(exc.value)
+    assert message.startswith('Result of the isolated worker could not be pickled: TypeError(')
+    assert 'lock' in message.splitlines()[0]
+    assert message.splitlines()[1].startswith("{'lock': <")
+
+
+def test_budget_restores_outer_timer():
+    def outer_handler(signum, frame):
+        pass
+
+    handler = signal.signal(signal.SIGALRM, outer_handler)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, 10)
+        Budget(wall=1).call(lambda: None)
+
+        assert signal.getsignal(signal.SIGALRM) is outer_handler
+        assert 9 < signal.getitimer(signal.ITIMER_REAL)[0] <= 10
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
+
+
+def test_empty_budget_calls_function_directly(mocker):
+    function = mocker.Mock(return_value=1)
+
+    assert not Budget()
+    assert Budget().call(function, 'a') == 1
+    function.assert_called_once_with('a')
@@ -0,0 +1,260 @@
+import pytest
+
+from pytest_check_mk import isolation
+from pytest_check_mk.file_loader import CodeCache
+
+
+@pytest.fixture
+def namespace():
+    return {
+        'counter': 0,
+        'items': [1, 2],
+        'settings': {'levels': (80, 90), 'nested': {'key': 'value'}},
+        'known': set(['a']),
+    }
+
+
+def test_restore_rebinds_changed_and_removes_new_globals(namespace):
+    snapshot = isolation.NamespaceSnapshot(namespace)
+    items = namespace['items']
+
+    namespace['counter'] = 5
+    namespace['items'] = []
+    namespace['new_name'] = 'foo'
+
+    assert snapshot.changed_names() == set(['counter', 'items', 'new_name'])
+    assert snapshot.restore()
+    assert namespace['counter'] == 0
+    assert namespace['items'] is items
+    assert 'new_name' not in namespace
+
+
+def test_restore_refills_containers_changed_in_place(namespace):
+    snapshot = isolation.NamespaceSnapshot(namespace)
+    settings = namespace['settings']
+    nested = settings['nested']
+
+    namespace['items'].append(3)
+    namespace['known'].add('b')
+    settings['levels'] = (1, 2)
+    nested['key'] = 'changed'
+    del nested['key']
+
+    assert snapshot.restore()
+    assert namespace['items'] == [1, 2]
+    assert namespace['known'] == set(['a'])
+    assert namespace['settings'] is settings
+    assert settings['nested'] is nested
+    assert settings == {'levels': (80, 90), 'nested': {'key': 'value'}}
+
+
+def test_restore_handles_containers_inside_tuples():
+    namespace = {'pairs': ([1], [2])}
+    snapshot = isolation.NamespaceSnapshot(namespace)
+
+    namespace['pairs'][0].append(5)
+
+    assert snapshot.restore()
+    assert namespace['pairs'] == ([1], [2])
+
+
+def test_snapshot_with_opaque_object_is_not_restorable(namespace):
+    class Opaque(object):
+        pass
+
+    namespace['instance'] = Opaque()
+
+    snapshot = isolation.NamespaceSnapshot(namespace)
+
+    assert not snapshot.restorable
+    assert not snapshot.restore()
+
+
+def module_namespace(source):
+    namespace = {'__name__': 'example'}
+    exec(source, namespace)
+    return namespace
+
+
+def test_restore_resets_mutable_default_arguments():
+    namespace = module_namespace('def check(item, _seen=[], *, _cache={}):\n    _seen.append(item)\n')
+    snapshot = isolation.NamespaceSnapshot(namespace)
+    check = namespace['check']
+    seen = check.__defaults__[0]
+
+    check('a')
+    check.__kwdefaults__['_cache']['a'] = 1
+
+    assert snapshot.restorable
+    assert snapshot.restore()
+    assert check.__defaults__[0] is seen
+    assert seen == []
+    assert check.__kwdefaults__ == {'_cache': {}}
+
+
+def test_restore_resets_rebound_defaults_and_function_attributes():
+    namespace = module_namespace('def check(item, limit=10):\n    pass\n\ncheck.calls = []\n')
+    snapshot = isolation.NamespaceSnapshot(namespace)
+    check = namespace['check']
+
+    check.__defaults__ = (20,)
+    check.calls.append(1)
+    check.other = True
+
+    assert snapshot.restore()
+    assert check.__defaults__ == (10,)
+    assert check.__dict__ == {'calls': []}
+
+
+@pytest.mark.skipif(not isolation._WRITABLE_CELLS, reason='closure cells are writable since Python 3.7')
+def test_restore_resets_closure_cells():
+    namespace = module_namespace('''
+def make_counter():
+    count = 0
+    items = []
+    def counter():
+        nonlocal count
+        count += 1
+        items.append(count)
+        return count
+    return counter
+
+counter = make_counter()
+''')
+    snapshot = isolation.NamespaceSnapshot(namespace)
+
+    assert namespace['counter']() == 1
+
+    assert snapshot.restore()
+    assert namespace['counter']() == 1
+
+
+def test_restore_resets_class_attributes():
+    namespace = module_namespace('''
+class State(object):
+    count = 0
+    seen = []
+
+    @staticmethod
+    def helper(_cache={}):
+        return _cache
+''')
+    snapshot = isolation.NamespaceSnapshot(namespace)
+    State = namespace['State']
+
+    State.count += 1
+    State.seen.append(1)
+    State.helper()['a'] = 1
+    State.new = 'value'
+
+    assert snapshot.restorable
+    assert snapshot.restore()
+    assert State.count == 0
+    assert State.seen == []
+    assert State.helper() == {}
+    assert not hasattr(State, 'new')
+
+
+def test_restore_resets_object_of_bound_builtin_method():
+    namespace = module_namespace('_store = {}.setdefault\n')
+    snapshot = isolation.NamespaceSnapshot(namespace)
+
+    namespace['_store']('a', 1)
+
+    assert snapshot.restorable
+    assert snapshot.restore()
+    assert namespace['_store'].__self__ == {}
+
+
+def test_snapshot_with_method_of_opaque_object_is_not_restorable():
+    namespace = module_namespace('''
+class Cache(object):
+    def add(self, key):
+        self.key = key
+
+add = Cache().add
+''')
+    snapshot = isolation.NamespaceSnapshot(namespace)
+
+    assert not snapshot.restorable
+
+
+def test_functions_and_classes_of_other_modules_are_not_tracked():
+    namespace = module_namespace('''
+from collections import OrderedDict
+from os import getcwd
+from os.path import join
+''')
+    snapshot = isolation.NamespaceSnapshot(namespace)
+
+    assert snapshot.restorable
+    assert not snapshot._containers
+
+
+def test_module_pool_reuses_restored_module(tmpdir):
+    path = str(tmpdir.join('example'))
+    tmpdir.join('example').write('check_info["example"] = {}\nstate = []\n')
+    pool = isolation.ModulePool(CodeCache())
+
+    module = pool.acquire('example', path)
+    module.state.append(1)
+    module.check_info['example']['changed'] = True
+    pool.release(module)
+
+    assert pool.acquire('example', path) is module
+    assert module.state == []
+    assert module.check_info == {'example': {}}
+
+
+def test_module_pool_hands_out_separate_module_while_in_use(tmpdir):
+    path = str(tmpdir.join('example'))
+    tmpdir.join('example').write('state = []\n')
+    pool = isolation.ModulePool(CodeCache())
+
+    assert pool.acquire('example', path) is not pool.acquire('example', path)
+
+
+def test_module_pool_reloads_module_that_cannot_be_restored(tmpdir):
+    path = str(tmpdir.join('example'))
+    tmpdir.join('example').write('class Foo(object):\n    pass\n\nstate = Foo()\n')
+    pool = isolation.ModulePool(CodeCache())
+
+    module = pool.acquire('example', path)
+    pool.release(module)
+
+    assert pool.acquire('example', path) is not module
+
+
+def test_module_pool_reloads_module_when_include_changes(tmpdir):
+    tmpdir.join('example').write('check_includes["example"] = ["example.include"]\n')
+    tmpdir.join('example.include').write('value = 1\n')
+    tmpdir.join('other').write('value = 1\n')
+    path = str(tmpdir.join('example'))
+    pool = isolation.ModulePool(CodeCache())
+
+    module = pool.acquire('example', path)
+    other = pool.acquire('other', str(tmpdir.join('other')))
+    pool.release(module)
+    pool.release(other)
+    tmpdir.join('example.include').write('value = 22\n')
+
+    assert pool.acquire('other', str(tmpdir.join('other'))) is other
+    reloaded = pool.acquire('example', path)
+    assert reloaded is not module
+    assert reloaded.value == 22
+
+
+def test_module_pool_invalidate_drops_dependent_modules_only(tmpdir):
+    tmpdir.join('example').write('check_includes["example"] = ["example.include"]\n')
+    tmpdir.join('example.include').write('value = 1\n')
+    tmpdir.join('other').write('value = 1\n')
+    pool = isolation.ModulePool(CodeCache())
+    module = pool.acquire('example', str(tmpdir.join('example')))
+    other = pool.acquire('other', str(tmpdir.join('other')))
+    pool.release(module)
+    pool.release(other)
+
+    pool.invalidate(str(tmpdir.join('example.include')))
+
+    assert pool.acquire('example', str(tmpdir.join('example'))) is not module
+    assert pool.acquire('other', str(tmpdir.join('other'))) is other
@@ -0,0 +1,85 @@
+import pytest
+
+tracemalloc = pytest.importorskip('tracemalloc')
+
+from pytest_check_mk import memory, parser, wrapper  # noqa
+
+
+def temporary_rows(count):
+    rows = [['x' * 100, str(i)] for i in range(count)]
+    return len(rows)
+
+
+def kept_rows(count):
+    return [['x' * 100, str(i)] for i in range(count)]
+
+
+def check_with_helper(count):
+    return [temporary_rows(count) for _ in range(2)]
+
+
+def test_measure_memory_reports_peak_and_retained_bytes():
+    temporary = memory.measure_memory(temporary_rows, 10000)
+    kept = memory.measure_memory(kept_rows, 10000)
+
+    assert temporary.result == 10000
+    assert temporary.peak > 10000 * 100
+    assert temporary.retained < 10000 * 10
+    assert kept.retained > 10000 * 100
+    assert kept.peak >= kept.retained
+    assert not tracemalloc.is_tracing()
+
+
+def test_measure_memory_while_already_tracing():
+    tracemalloc.start()
+    try:
+        kept_rows(10000)
+        usage = memory.measure_memory(temporary_rows, 100)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    assert usage.peak < 10000 * 100
+
+
+def test_peak_allocation_sites_finds_freed_allocations():
+    statistics = memory.peak_allocation_sites(check_with_helper, 10000)
+
+    top = statistics[0].traceback[0]
+    assert top.filename == __file__
+    assert top.lineno == temporary_rows.__code__.co_firstlineno + 1
+    assert statistics[0].size_diff > 10000 * 100
+
+
+def test_memory_of_check_and_parse_function(mocker):
+    module = mocker.Mock()
+    module.check_info = {'foo': {
+        'parse_function': lambda info: [line * 100 for line in info],
+        'check_function': lambda item, params, parsed: (0, str(len(parsed))),
+    }}
+    check = wrapper.CheckFileWrapper('foo', module)['foo']
+    output = '<<<foo>>>\n' + 'a b c\n' * 1000
+
+    parse = memory.measure_memory(check.parse, output)
+    first = memory.measure_memory(check.check, None, None, output)
+    second = memory.measure_memory(check.check, None, None, output)
+
+    assert parse.retained > 1000 * 100 * 8
+    # Parsing is measured in every call, and its results are not kept in caches
+    assert first.peak > parse.retained
+    assert abs(second.peak - first.peak) < first.peak / 10
+    assert first.retained < 10000
+    assert second.retained < 10000
+
+
+def test_measure_memory_leaves_caches_alone(mocker):
+    module = mocker.Mock()
+    module.check_info = {'foo': {'check_function': lambda item, params, info: (0, str(len(info)))}}
+    check_file = wrapper.CheckFileWrapper('foo', module)
+    output = '<<<foo>>>\n' + 'a b c\n' * 1000
+    parser.parse_info_cache_clear()
+
+    memory.measure_memory(check_file['foo'].check, None, None, output)
+
+    assert parser.parse_info_cache_info().currsize == 0
+    assert check_file.parse_cache_info().currsize == 0
@@ -0,0 +1,423 @@
+import io
+import mmap
+import types
+
+import pytest
+
+from pytest_check_mk import parser
+
+
+AGENT_OUTPUT = '''garbage before the first header
+<<<foo>>>
+a bc
+d
+<<<bar:sep(59)>>>
+1;2 3
+<<<foo>>>
+e
+'''
+
+
+def test_parse_agent_output_indexes_all_sections():
+    index = parser.parse_agent_output(AGENT_OUTPUT)
+
+    assert sorted(index) == ['bar', 'foo']
+    assert len(index) == 2
+    assert index['foo'].info == [['a', 'bc'], ['d'], ['e']]
+    assert index['bar'].info == [['1', '2 3']]
+    assert index['bar'].options == {'sep': '59'}
+    assert 'baz' not in index
+    assert index.get('baz') is None
+
+
+@pytest.mark.parametrize('check_output', [
+    '<<<foo>>>',
+    '<<<foo>>>\na bc',
+    '<<<bar>>>\na bc\nd',
+    '<<<bar>>>\na   b',
+    '<<<bar:sep(48)>>>\n101',
+])
+def test_parse_agent_output_agrees_with_parse_info(check_output):
+    section_name, info = parser.parse_info(check_output)
+
+    assert parser.parse_agent_output(check_output)[section_name].info == info
+
+
+def test_section_copy_info_returns_independent_rows():
+    section = parser.Section('foo', {}, [['a', 'b']])
+
+    info = section.copy_info()
+    info[0].append('c')
+
+    assert section.info == [['a', 'b']]
+
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache = parser.LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.info() == parser.CacheInfo(hits=3, misses=1, maxsize=2, currsize=2)
+
+
+def test_lru_cache_bounds_total_size():
+    cache = parser.LRUCache(maxsize=10, maxbytes=10)
+    cache.put('a', 1, 4)
+    cache.put('b', 2, 4)
+    cache.put('c', 3, 4)
+    cache.put('d', 4, 11)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert cache.get('c') == 3
+    assert cache.get('d') is None
+    assert cache.info().currsize == 2
+
+
+def test_lru_cache_is_bypassed_within_bypass_caches():
+    cache = parser.LRUCache(maxsize=2)
+    cache.put('a', 1)
+
+    with parser.bypass_caches():
+        assert cache.get('a') is None
+        cache.put('b', 2)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+
+
+def test_parse_info_caches_parsed_output():
+    parser.parse_info_cache_clear()
+
+    first = parser.parse_info('<<<foo>>>\na b')
+    second = parser.parse_info('<<<foo>>>\na b')
+    parser.parse_info('<<<foo>>>\nc')
+
+    assert first == second == ('foo', [['a', 'b']])
+    assert parser.parse_info_cache_info() == parser.CacheInfo(hits=1, misses=2, maxsize=128, currsize=2)
+
+
+def test_parse_info_does_not_cache_large_output(monkeypatch):
+    parser.parse_info_cache_clear()
+    monkeypatch.setattr(parser._parse_info_cache, 'maxbytes', 100)
+
+    parser.parse_info('<<<foo>>>\n' + 'a b\n' * 100)
+    parser.parse_info('<<<foo>>>\n' + 'a b\n' * 100)
+
+    assert parser.parse_info_cache_info() == parser.CacheInfo(hits=0, misses=2, maxsize=128, currsize=0)
+
+
+def test_parse_info_returns_fresh_info_from_cache():
+    parser.parse_info_cache_clear()
+
+    _, info = parser.parse_info('<<<foo>>>\na b')
+    info[0].append('c')
+    info.append(['d'])
+
+    assert parser.parse_info('<<<foo>>>\na b') == ('foo', [['a', 'b']])
+
+
+def test_parse_info_does_not_cache_invalid_output():
+    parser.parse_info_cache_clear()
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            parser.parse_info('<<<foo')
+
+    assert parser.parse_info_cache_info().currsize == 0
+
+
+@pytest.fixture
+def agent_output_file(tmpdir):
+    path = tmpdir.join('agent_output')
+    path.write_binary(AGENT_OUTPUT.replace('\n', '\r\n').encode('utf-8'))
+    return path
+
+
+def _open_binary(path):
+    return path.open('rb')
+
+
+def _open_text(path):
+    return io.open(str(path), 'r', encoding='utf-8')
+
+
+def _open_mmap(path):
+    f = path.open('rb')
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@pytest.mark.parametrize('open_source', [str, _open_binary, _open_text, _open_mmap])
+def test_read_agent_output_from_source(agent_output_file, open_source):
+    index = parser.read_agent_output(open_source(agent_output_file))
+
+    assert sorted(index) == ['bar', 'foo']
+    assert index['foo'].info == [['a', 'bc'], ['d'], ['e']]
+    assert index['bar'].info == [['1', '2 3']]
+
+
+def test_read_agent_output_skips_sections_not_requested(agent_output_file):
+    index = parser.read_agent_output(str(agent_output_file), sections=['bar'])
+
+    assert list(index) == ['bar']
+    assert index['bar'].info == [['1', '2 3']]
+
+
+def test_iter_section_rows_yields_rows_of_all_occurrences(agent_output_file):
+    rows = parser.iter_section_rows(_open_mmap(agent_output_file), 'foo')
+
+    assert isinstance(rows, types.GeneratorType)
+    assert list(rows) == [['a', 'bc'], ['d'], ['e']]
+
+
+def test_read_agent_output_memory_is_bounded_by_requested_sections(tmpdir):
+    tracemalloc = pytest.importorskip('tracemalloc')
+    path = tmpdir.join('agent_output')
+    with path.open('w') as f:
+        f.write('<<<ps>>>\n')
+        for i in range(100000):
+            f.write('(root,1234,567,0.0) /usr/sbin/some_daemon --with --some --arguments {}\n'.format(i))
+        f.write('<<<uptime>>>\n12345.67 23456.78\n')
+
+    tracemalloc.start()
+    try:
+        index = parser.read_agent_output(str(path), sections=['uptime'])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert index['uptime'].info == [['12345.67', '23456.78']]
+    assert peak < path.size() / 10
+
+
+@pytest.mark.parametrize('convert', [bytes, bytearray, memoryview])
+def test_parse_agent_output_from_bytes_agrees_with_text(convert):
+    text_index = parser.parse_agent_output(AGENT_OUTPUT)
+
+    index = parser.parse_agent_output(convert(AGENT_OUTPUT.encode('utf-8')))
+
+    assert sorted(index) == sorted(text_index)
+    for name in index:
+        assert index[name].options == text_index[name].options
+        assert index[name].info == text_index[name].info
+
+
+def test_parse_agent_output_from_bytes_decodes_sections_on_first_use():
+    index = parser.parse_agent_output(b'<<<foo>>>\na b\n<<<bar>>>\nc\n')
+
+    assert index['foo']._chunks is not None
+    assert index['foo'].info == [['a', 'b']]
+    assert index['foo']._chunks is None
+    assert index['bar']._chunks is not None
+
+
+@pytest.mark.parametrize('data, expected_info', [
+    (u'<<<foo>>>\nmäh\n'.encode('utf-8'), [[u'mäh']]),
+    (u'<<<foo>>>\nmäh\n'.encode('latin-1'), [[u'mäh']]),
+    (u'<<<foo:encoding(cp1252)>>>\n€ 1\n'.encode('cp1252'), [[u'€', u'1']]),
+    (u'<<<foo:sep(59):encoding(latin-1)>>>\n ä;b \n'.encode('latin-1'), [[u'ä', u'b']]),
+])
+def test_parse_agent_output_from_bytes_decodes_fields(data, expected_info):
+    assert parser.parse_agent_output(data)['foo'].info == expected_info
+
+
+PIGGYBACK_OUTPUT = '''<<<foo>>>
+own
+<<<<vm1>>>>
+<<<foo>>>
+vm1 a
+<<<bar>>>
+vm1 b
+<<<<>>>>
+<<<bar>>>
+own bar
+<<<<vm2>>>>
+<<<foo>>>
+vm2 a
+<<<<vm1>>>>
+<<<foo>>>
+vm1 c
+'''
+
+
+@pytest.mark.parametrize('parse', [
+    parser.parse_agent_output,
+    lambda output: parser.parse_agent_output(output.encode('utf-8')),
+    lambda output: parser.read_agent_output(io.StringIO(output)),
+])
+def test_parse_agent_output_partitions_piggyback_hosts(parse):
+    index = parse(PIGGYBACK_OUTPUT)
+
+    assert sorted(index) == ['bar', 'foo']
+    assert index['foo'].info == [['own']]
+    assert index['bar'].info == [['own', 'bar']]
+    assert sorted(index.piggyback) == ['vm1', 'vm2']
+    assert index.piggyback['vm1']['foo'].info == [['vm1', 'a'], ['vm1', 'c']]
+    assert index.piggyback['vm1']['bar'].info == [['vm1', 'b']]
+    assert list(index.piggyback['vm2']) == ['foo']
+    assert [host for host, _ in index.hosts()] == [None, 'vm1', 'vm2']
+
+
+def test_iter_section_rows_of_piggybacked_host():
+    rows = parser.iter_section_rows(io.StringIO(PIGGYBACK_OUTPUT), 'foo', host='vm1')
+
+    assert list(rows) == [['vm1', 'a'], ['vm1', 'c']]
+
+
+@pytest.mark.parametrize('header, expected_options', [
+    ('<<<foo>>>', {}),
+    ('  <<<foo:sep(9)>>>  ', {'sep': '9'}),
+    ('<<<foo:sep(124):nostrip>>>', {'sep': '124', 'nostrip': None}),
+    ('<<<foo:nostrip()>>>', {'nostrip': ''}),
+    ('<<<foo:cached(1500000000,60)>>>', {'cached': '1500000000,60'}),
+    ('<<<foo:persist(1500000000):encoding(cp437)>>>', {'persist': '1500000000', 'encoding': 'cp437'}),
+])
+def test_parse_header_options(header, expected_options):
+    assert parser.parse_header(header) == ('foo', expected_options)
+
+
+@pytest.mark.parametrize('option', ['sep(48', 'sep(x)', 'cached(60)', 'persist()', 'encoding(no-such-codec)'])
+def test_parse_header_rejects_invalid_option(option):
+    with pytest.raises(ValueError) as exc:
+        parser.parse_header('<<<foo:{}>>>'.format(option))
+    assert 'Invalid section option {}'.format(option) in str(exc.value)
+
+
+def test_section_parses_options():
+    index = parser.parse_agent_output(
+        '<<<foo:cached(1500000000,60):persist(1500000100):sep(59):nostrip:encoding(latin-1)>>>\n')
+
+    section = index['foo']
+    assert section.cached == (1500000000, 60)
+    assert section.persist == 1500000100
+    assert section.separator == ';'
+    assert section.nostrip
+    assert section.encoding == 'latin-1'
+    assert parser.parse_agent_output('<<<foo>>>\n')['foo'].cached is None
+
+
+@pytest.mark.parametrize('header, expected_info', [
+    ('<<<foo>>>', [['a', 'b'], ['c']]),
+    ('<<<foo:nostrip>>>', [['a', 'b'], ['c']]),
+    ('<<<foo:sep(59)>>>', [['a', 'b'], ['c']]),
+    ('<<<foo:sep(59):nostrip>>>', [[' a', 'b '], ['c']]),
+])
+@pytest.mark.parametrize('parse', [
+    lambda output: parser.parse_info(output)[1],
+    lambda output: parser.parse_agent_output(output)['foo'].info,
+    lambda output: parser.parse_agent_output(output.encode('utf-8'))['foo'].info,
+    lambda output: parser.read_agent_output(io.BytesIO(output.encode('utf-8')))['foo'].info,
+])
+def test_nostrip_keeps_surrounding_whitespace_but_not_line_endings(parse, header, expected_info):
+    separator = ';' if 'sep' in header else ' '
+    output = '{}\r\n a{}b \r\nc\r\n'.format(header, separator)
+
+    assert parse(output) == expected_info
+
+
+def test_read_agent_output_decodes_lines_with_section_encoding():
+    data = u'<<<foo:encoding(cp437)>>>\n░\n'.encode('cp437') + u'<<<bar>>>\n\xe4\n'.encode('latin-1')
+
+    index = parser.read_agent_output(io.BytesIO(data))
+
+    assert index['foo'].info == [[u'░']]
+    assert index['bar'].info == [[u'\xe4']]
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('<<<foo>>>', True),
+    ('  <<<foo>>> ', True),
+    ('<<<foo', False),
+    ('foo>>>', False),
+    (' x <<<foo>>>', False),
+    ('', False),
+])
+def test_is_header(line, expected):
+    assert parser.is_header(line) is expected
+
+
+def test_columnar_info_behaves_like_list_of_rows():
+    rows = [['a', 'b'], [], ['b', 'c', 'a']]
+    info = parser.ColumnarInfo(rows)
+
+    assert len(info) == 3
+    assert info == rows
+    assert list(info) == rows
+    assert info[0] == ['a', 'b']
+    assert info[-1] == ['b', 'c', 'a']
+    assert info[1:] == rows[1:]
+    assert info != rows[:2]
+    with pytest.raises(IndexError):
+        info[3]
+
+    info[0].append('x')
+    assert info[0] == ['a', 'b']
+
+
+def test_columnar_info_interns_repeated_fields_only():
+    info = parser.ColumnarInfo()
+    info.extend([['root', '1'], ['root', '2']])
+    info.append(['www', '1'])
+
+    assert info._tokens == ['root', '1']
+    assert list(info._fields) == [4, 5, 0x8000, 1, 3, 0x8001]
+    assert bytes(info._buffer) == b'root12www'
+    assert info == [['root', '1'], ['root', '2'], ['www', '1']]
+
+
+def test_columnar_info_with_non_ascii_and_long_rows():
+    rows = [['\xe4\xf6', 'x', '\u20ac'], ['x' * 40000, '\xe4\xf6'], ['x', '']]
+    info = parser.ColumnarInfo(rows)
+
+    assert info._fields.typecode == 'I'
+    assert list(info) == rows
+    assert [info[i] for i in range(3)] == rows
+
+
+@pytest.mark.parametrize('parse', [
+    lambda output: parser.parse_agent_output(output, columnar=True),
+    lambda output: parser.parse_agent_output(output.encode('utf-8'), columnar=True),
+    lambda output: parser.read_agent_output(io.StringIO(output), columnar=True),
+])
+def test_parse_agent_output_columnar(parse):
+    index = parse(AGENT_OUTPUT + PIGGYBACK_OUTPUT)
+
+    expected = parser.parse_agent_output(AGENT_OUTPUT + PIGGYBACK_OUTPUT)
+    for host, host_index in expected.hosts():
+        for name in host_index:
+            info = index.for_host(host)[name].info
+            assert isinstance(info, parser.ColumnarInfo)
+            assert info == host_index[name].info
+    assert index['foo'].copy_info() is index['foo'].info
+
+
+@pytest.mark.parametrize('line', [
+    # ps with unique PIDs and sizes
+    '(root,{0},{1},00:00:01/01:02:03,{2}) /usr/sbin/daemon{4} --config /etc/daemon.conf',
+    # lnx_if with unique counters
+    'eth{4} {0} {1} 0 0 0 0 0 {2} {3} 0 0 0 0 0 0 0',
+])
+def test_columnar_info_needs_a_fraction_of_the_memory(line):
+    tracemalloc = pytest.importorskip('tracemalloc')
+    lines = [line.format(i * 7919 + 10 ** 6, i * 104729 + 10 ** 7, i * 13 + 10 ** 8, i * 17 + 10 ** 9, i % 20)
+             for i in range(20000)]
+
+    def allocated(build):
+        tracemalloc.start()
+        try:
+            info = build()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        assert len(info) == len(lines)
+        return size
+
+    rows = allocated(lambda: [line.split() for line in lines])
+    columnar = allocated(lambda: parser.ColumnarInfo(line.split() for line in lines))
+
+    assert columnar * 4 < rows
@@ -0,0 +1,104 @@
+import os
+
+import pstats
+
+from pytest_check_mk.profiling import CheckProfiler, collapsed_stacks, function_label
+
+
+def leaf(n):
+    return sum(range(n))
+
+
+def branch():
+    return leaf(10000) + leaf(20000)
+
+
+def generate():
+    for i in range(3):
+        yield leaf(1000 * i)
+
+
+def test_profiler_aggregates_calls_by_check_name():
+    profiler = CheckProfiler()
+
+    assert profiler.call('df', branch) == branch()
+    profiler.call('df', leaf, 10)
+    profiler.call('mem', leaf, 10)
+
+    assert sorted(profiler.profiles) == ['df', 'mem']
+    calls = dict((function[2], value[1]) for function, value in profiler.stats('df').stats.items())
+    assert calls['branch'] == 1
+    assert calls['leaf'] == 3
+    assert "<method 'disable' of '_lsprof.Profiler' objects>" not in calls
+
+
+def test_profiler_consumes_generators():
+    profiler = CheckProfiler()
+
+    assert profiler.call('df', generate) == [0, 499500, 1999000]
+    calls = dict((function[2], value[1]) for function, value in profiler.stats('df').stats.items())
+    assert calls['leaf'] == 3
+
+
+def test_profiler_writes_pstats_and_collapsed_stacks(tmpdir):
+    profiler = CheckProfiler()
+    for _ in range(20):
+        profiler.call('foo.bar', branch)
+
+    paths = profiler.write(str(tmpdir.join('profile')), '.gw0')
+
+    assert [os.path.basename(path) for path in paths] == ['foo.bar.gw0.pstats', 'foo.bar.gw0.collapsed']
+    assert any(function[2] == 'branch' for function in pstats.Stats(paths[0]).stats)
+    stacks = []
+    for line in open(paths[1]).read().splitlines():
+        stack, microseconds = line.rsplit(' ', 1)
+        stacks.append(stack.split(';'))
+        assert int(microseconds) > 0
+    assert all(stack[0].endswith('(branch)') for stack in stacks)
+    assert any(stack[1:2] == ['{}:{}(leaf)'.format(leaf.__code__.co_filename, leaf.__code__.co_firstlineno)]
+               for stack in stacks)
+
+
+def test_collapsed_stacks_split_time_by_caller():
+    a = ('checks/a', 1, 'a')
+    b = ('checks/a', 5, 'b')
+    c = ('checks/a', 9, 'c')
+    builtin = ('~', 0, '<built-in method builtins.len>')
+    stats = {
+        a: (1, 1, 0.001, 0.01, {}),
+        b: (1, 1, 0.002, 0.004, {a: (1, 1, 0.002, 0.004)}),
+        c: (3, 3, 0.003, 0.003, {a: (1, 1, 0.001, 0.001), b: (2, 2, 0.002, 0.002)}),
+        builtin: (1, 1, 0.002, 0.002, {a: (1, 1, 0.002, 0.002)}),
+    }
+
+    assert collapsed_stacks(stats) == {
+        'checks/a:1(a)': 1000,
+        'checks/a:1(a);checks/a:5(b)': 2000,
+        'checks/a:1(a);checks/a:5(b);checks/a:9(c)': 2000,
+        'checks/a:1(a);checks/a:9(c)': 1000,
+        'checks/a:1(a);<built-in method builtins.len>': 2000,
+    }
+
+
+def test_collapsed_stacks_fold_recursion():
+    a = ('checks/a', 1, 'a')
+    stats = {a: (1, 5, 0.005, 0.005, {a: (4, 4, 0.004, 0.004)})}
+
+    assert collapsed_stacks(stats) == {'checks/a:1(a)': 5000}
+
+
+def test_hot_functions_are_limited_to_check_files(tmpdir):
+    checks = tmpdir.mkdir('checks')
+    path = str(checks.join('example'))
+    code = compile('def check_example(n):\n    return sorted(range(n))\n', path, 'exec')
+    namespace = {}
+    exec(code, namespace)
+    profiler = CheckProfiler()
+    profiler.call('example', namespace['check_example'], 100000)
+
+    hot = profiler.hot_functions(directory=str(checks))
+
+    assert [(h.check, h.function, h.calls) for h in hot] == [('example', (path, 1, 'check_example'), 1)]
+    assert function_label(hot[0].function) == path + ':1(check_example)'
+    assert profiler.summary_lines(directory=str(checks))[0].endswith(
+        ' 1 calls  example: {}:1(check_example)'.format(path))
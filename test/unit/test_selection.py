@@ -0,0 +1,79 @@
+from pytest_check_mk.selection import ChangeTracker
+
+
+class FakeCache(object):
+
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    def get(self, key, default):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+class FakeConfig(object):
+
+    def __init__(self, cache, workerinput=None):
+        self.cache = cache
+        if workerinput is not None:
+            self.workerinput = workerinput
+            self.workeroutput = {}
+
+
+class FakeNode(object):
+
+    def __init__(self, workeroutput):
+        self.workeroutput = workeroutput
+
+
+class FakeReport(object):
+
+    def __init__(self, nodeid, failed):
+        self.nodeid = nodeid
+        self.failed = failed
+
+
+def run_worker(cache, dependencies, failed=()):
+    config = FakeConfig(cache, workerinput={'workerid': 'gw0'})
+    tracker = ChangeTracker(config, None)
+    tracker.dependencies.update(dependencies)
+    for nodeid in failed:
+        tracker.pytest_runtest_logreport(FakeReport(nodeid, True))
+    tracker.pytest_sessionfinish(None)
+    return FakeNode(config.workeroutput)
+
+
+def test_controller_stores_dependencies_of_all_workers():
+    cache = FakeCache({ChangeTracker.CACHE_KEY: {'test_old.py::test': {'a': '1'}, 'test_c.py::test': {'c': '0'}}})
+    controller = ChangeTracker(FakeConfig(cache), None)
+
+    nodes = [
+        run_worker(cache, {'test_a.py::test': {'a': '1'}}),
+        run_worker(cache, {'test_b.py::test': {'b': '2'}, 'test_c.py::test': {'c': '3'}}, failed=['test_c.py::test']),
+    ]
+    assert cache.values[ChangeTracker.CACHE_KEY] == {'test_old.py::test': {'a': '1'}, 'test_c.py::test': {'c': '0'}}
+
+    for node in nodes:
+        controller.pytest_testnodedown(node, None)
+    controller.pytest_sessionfinish(None)
+
+    assert cache.values[ChangeTracker.CACHE_KEY] == {
+        'test_old.py::test': {'a': '1'},
+        'test_a.py::test': {'a': '1'},
+        'test_b.py::test': {'b': '2'},
+    }
+
+
+def test_sessions_merge_with_dependencies_stored_meanwhile():
+    cache = FakeCache()
+    first = ChangeTracker(FakeConfig(cache), None)
+    second = ChangeTracker(FakeConfig(cache), None)
+    first.dependencies['test_a.py::test'] = {'a': '1'}
+    second.dependencies['test_b.py::test'] = {'b': '2'}
+
+    first.pytest_sessionfinish(None)
+    second.pytest_sessionfinish(None)
+
+    assert sorted(cache.values[ChangeTracker.CACHE_KEY]) == ['test_a.py::test', 'test_b.py::test']
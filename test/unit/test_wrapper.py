@@ -1,6 +1,6 @@
 import pytest
 
-from pytest_check_mk import wrapper
+from pytest_check_mk import parser, wrapper
 
 
 @pytest.mark.parametrize('check_output, expected_section_name, expected_info', [
@@ -26,6 +26,36 @@ def checks(mocker):
     return wrapper.CheckFileWrapper(name, module)
 
 
+def test_check_file_wrapper_loads_module_on_first_access(mocker):
+    module = mocker.Mock()
+    load_module = mocker.Mock(return_value=module)
+    check_file = wrapper.CheckFileWrapper('foo', load_module=load_module)
+
+    assert not check_file.is_loaded
+    assert not load_module.called
+    assert check_file.module is module
+    assert check_file.module is module
+    load_module.assert_called_once_with()
+
+
+def test_check_file_wrapper_answers_check_names_without_loading(mocker):
+    load_module = mocker.Mock()
+    code_cache = mocker.Mock()
+    code_cache.get.return_value.check_names = ('foo.bar', 'foo')
+    check_file = wrapper.CheckFileWrapper('foo', load_module=load_module, path='checks/foo', code_cache=code_cache)
+
+    assert check_file.check_names == ['foo', 'foo.bar']
+    code_cache.get.assert_called_once_with('checks/foo')
+    assert not load_module.called
+
+
+def test_check_names_of_loaded_module(checks):
+    checks.module.check_info['foo'] = {}
+    checks.module.check_info['foo.bar'] = {}
+
+    assert checks.check_names == ['foo', 'foo.bar']
+
+
 def test_has_no_perfdata(checks):
     checks.module.check_info['foo.bar'] = {}
 
@@ -144,3 +174,218 @@ def test_check_handles_multiple_yields_in_check(checks):
     checks.module.check_info['foo.bar'] = {'check_function': mock_check}
 
     assert checks['foo.bar'].check(item, params, check_output) == expected_result
+
+
+@pytest.mark.parametrize('subresults, expected_result', [
+    ([(0, 'a'), (0, None, [('x', 1)]), (1, '', [('y', 2)])], (1, 'a, (!)', [('x', 1), ('y', 2)])),
+    ([(0, 'a'), (2, None, [('x', 1)])], (0, 'a', [('x', 1)])),
+    ([(0, 'a'), (3, 'b')], (3, 'a, b(?)', [])),
+    ([(3, 'a'), (2, 'b'), (1, 'c')], (2, 'a(?), b(!!), c(!)', [])),
+    ([(0, 'a', (('x', 1),)), (0, 'b', [('y', 2)])], (0, 'a, b', [('x', 1), ('y', 2)])),
+    ([], (0, '', [])),
+])
+def test_check_combines_subresults(checks, subresults, expected_result):
+    checks.module.check_info['foo.bar'] = {'check_function': lambda *args: iter(subresults)}
+
+    result = checks['foo.bar'].check(None, None, '<<<foo>>>')
+
+    assert result == expected_result
+    assert tuple(result) == expected_result
+    assert result.subresults == subresults
+
+
+def test_check_result_joins_text_on_first_access(checks):
+    checks.module.check_info['foo.bar'] = {'check_function': lambda *args: ((0, str(i)) for i in range(1000))}
+
+    result = checks['foo.bar'].check(None, None, '<<<foo>>>')
+
+    assert result._text is None
+    assert result.status == 0
+    assert result[1] == ', '.join(str(i) for i in range(1000))
+    assert result.text is result[1]
+    status, text, perfdata = result
+    assert (status, perfdata) == (0, [])
+    assert repr(result).startswith("CheckResult(0, '0, 1, 2")
+
+
+def test_inventory_and_check_use_section_from_index(checks, mocker):
+    index = parser.parse_agent_output('<<<other>>>\nx\n<<<foo>>>\n1 2 3\n')
+    mock_inventory = mocker.Mock(return_value=[(None, None)])
+    mock_check = mocker.Mock(return_value=(0, 'mock'))
+    checks.module.check_info['foo.bar'] = {'inventory_function': mock_inventory, 'check_function': mock_check}
+
+    assert checks['foo.bar'].inventory(index) == [(None, None)]
+    assert checks['foo.bar'].check(None, None, index) == (0, 'mock')
+    mock_inventory.assert_called_with([['1', '2', '3']])
+    mock_check.assert_called_with(None, None, [['1', '2', '3']])
+
+
+def test_check_gets_columnar_info_from_columnar_index(checks, mocker):
+    index = parser.parse_agent_output('<<<foo>>>\n1 2 3\n', columnar=True)
+    mock_check = mocker.Mock(return_value=(0, 'mock'))
+    checks.module.check_info['foo.bar'] = {'check_function': mock_check}
+
+    checks['foo.bar'].check(None, None, index)
+    info = mock_check.call_args[0][2]
+    assert isinstance(info, parser.ColumnarInfo)
+    assert info == [['1', '2', '3']]
+
+
+def test_check_fails_on_missing_section_in_index(checks):
+    checks.module.check_info['foo.bar'] = {}
+
+    with pytest.raises(ValueError) as exc:
+        checks['foo.bar'].check(None, None, parser.parse_agent_output('<<<other>>>\nx'))
+
+    assert 'Section "foo" not found in agent output' in str(exc.value)
+
+
+def test_check_parses_bytes_as_complete_agent_output(checks, mocker):
+    mock_check = mocker.Mock(return_value=(0, 'mock'))
+    checks.module.check_info['foo.bar'] = {'check_function': mock_check}
+
+    checks['foo.bar'].check(None, None, b'<<<other>>>\nx\n<<<foo>>>\n1 2 3\n')
+
+    mock_check.assert_called_with(None, None, [['1', '2', '3']])
+
+
+def test_check_per_host_runs_check_for_every_host_with_section(checks):
+    checks.module.check_info['foo.bar'] = {
+        'inventory_function': lambda info: [(info[0][0], None)],
+        'check_function': lambda item, params, info: (0, ' '.join(info[0])),
+    }
+    agent_output = '<<<foo>>>\nown\n<<<<vm1>>>>\n<<<foo>>>\nvm1\n<<<<vm2>>>>\n<<<other>>>\nx\n'
+
+    assert checks['foo.bar'].inventory_per_host(agent_output) == {None: [('own', None)], 'vm1': [('vm1', None)]}
+    assert checks['foo.bar'].check_per_host('item', None, agent_output) == {None: (0, 'own'), 'vm1': (0, 'vm1')}
+
+
+def test_parse_function_runs_once_for_inventory_and_all_checks(checks, mocker):
+    parse_function = mocker.Mock(return_value={'a': 1, 'b': 2})
+    checks.module.check_info['foo'] = {
+        'parse_function': parse_function,
+        'inventory_function': lambda parsed: [(item, None) for item in sorted(parsed)],
+        'check_function': lambda item, params, parsed: (0, str(parsed[item])),
+    }
+    check_output = '<<<foo>>>\na 1\nb 2'
+
+    items = checks['foo'].inventory(check_output)
+    results = [checks['foo'].check(item, None, check_output) for item, _ in items]
+
+    assert results == [(0, '1'), (0, '2')]
+    parse_function.assert_called_once_with([['a', '1'], ['b', '2']])
+    assert checks.parse_cache_info().hits == 2
+
+
+def test_subcheck_uses_parse_function_of_main_check(checks, mocker):
+    mock_check = mocker.Mock(return_value=(0, 'mock'))
+    checks.module.check_info['foo'] = {'parse_function': lambda info: len(info)}
+    checks.module.check_info['foo.bar'] = {'check_function': mock_check}
+
+    checks['foo.bar'].check(None, None, '<<<foo>>>\na\nb')
+
+    mock_check.assert_called_with(None, None, 2)
+
+
+def test_parse_function_of_subcheck_is_ignored(checks, mocker):
+    mock_check = mocker.Mock(return_value=(0, 'mock'))
+    checks.module.check_info['foo.a'] = {'parse_function': lambda info: 'A', 'check_function': mock_check}
+    checks.module.check_info['foo.b'] = {'parse_function': lambda info: 'B', 'check_function': mock_check}
+
+    checks['foo.a'].check(None, None, '<<<foo>>>\na')
+    checks['foo.b'].check(None, None, '<<<foo>>>\na')
+
+    assert mock_check.call_args_list == [mocker.call(None, None, [['a']])] * 2
+
+
+@pytest.mark.parametrize('make_outputs', [
+    lambda: ('<<<foo>>>\na', '<<<foo>>>\nb'),
+    lambda: (parser.parse_agent_output('<<<foo>>>\na'), parser.parse_agent_output('<<<foo>>>\na')),
+])
+def test_parse_function_runs_for_every_output(checks, mocker, make_outputs):
+    parse_function = mocker.Mock(return_value=None)
+    checks.module.check_info['foo'] = {'parse_function': parse_function, 'check_function': lambda *args: (0, '')}
+
+    for check_output in make_outputs():
+        checks['foo'].check(None, None, check_output)
+        checks['foo'].check(None, None, check_output)
+
+    assert parse_function.call_count == 2
+
+
+def test_parse_function_result_is_not_cached_for_unhashable_output(checks, mocker):
+    parse_function = mocker.Mock(return_value=[])
+    checks.module.check_info['foo'] = {'parse_function': parse_function, 'check_function': lambda *args: (0, '')}
+
+    checks['foo'].check(None, None, bytearray(b'<<<foo>>>\na'))
+    checks['foo'].check(None, None, bytearray(b'<<<foo>>>\na'))
+
+    assert parse_function.call_count == 2
+
+
+def test_check_many_checks_given_items_on_one_output(checks, mocker):
+    mocker.spy(wrapper, 'parse_info')
+    checks.module.check_info['foo'] = {
+        'check_function': lambda item, params, info: (params, ' '.join(row[1] for row in info if row[0] == item)),
+    }
+
+    result = checks['foo'].check_many('<<<foo>>>\na 1\nb 2\na 3', [('a', 0), ('b', 1), ('c', 2)])
+
+    assert result.results == {'a': (0, '1 3'), 'b': (1, '2'), 'c': (2, '')}
+    assert list(result.results) == ['a', 'b', 'c']
+    assert set(result.timings) == {'a', 'b', 'c'}
+    assert all(timing >= 0 for timing in result.timings.values())
+    assert result.errors == {}
+    assert wrapper.parse_info.call_count == 1
+
+
+def test_check_many_with_duplicate_items_is_a_usage_error(checks, mocker):
+    mock_check = mocker.Mock(return_value=(0, ''))
+    checks.module.check_info['foo'] = {'check_function': mock_check}
+
+    with pytest.raises(pytest.UsageError) as exc:
+        checks['foo'].check_many('<<<foo>>>\nx', [('x', 1), ('y', 1), ('x', 2)])
+
+    assert str(exc.value) == "check_many got items more than once: 'x'"
+    assert not mock_check.called
+
+
+def test_check_many_checks_all_inventoried_items(checks):
+    checks.module.foo_default_levels = (80, 90)
+    checks.module.check_info['foo'] = {
+        'inventory_function': lambda info: [(row[0], 'foo_default_levels') for row in info] + [('x', 'other')],
+        'check_function': lambda item, params, info: (0, '{} {}'.format(item, params)),
+    }
+
+    result = checks['foo'].check_many('<<<foo>>>\na\nb')
+
+    assert result.results == {'a': (0, 'a (80, 90)'), 'b': (0, 'b (80, 90)'), 'x': (0, 'x other')}
+
+
+def test_check_many_collects_errors_of_single_items(checks):
+    def check_function(item, params, info):
+        info.pop()  # every check gets its own info
+        if item == 'b':
+            raise KeyError(item)
+        return 0, str(len(info))
+
+    checks.module.check_info['foo'] = {'check_function': check_function}
+
+    result = checks['foo'].check_many('<<<foo>>>\nx\ny', [('a', None), ('b', None), ('c', None)])
+
+    assert result.results == {'a': (0, '1'), 'c': (0, '1')}
+    assert list(result.errors) == ['b']
+    assert isinstance(result.errors['b'], KeyError)
+    assert set(result.timings) == {'a', 'b', 'c'}
+
+
+def test_check_many_shares_parsed_section(checks, mocker):
+    parse_function = mocker.Mock(return_value={'a': 1})
+    checks.module.check_info['foo'] = {
+        'parse_function': parse_function,
+        'inventory_function': lambda parsed: [(item, None) for item in parsed],
+        'check_function': lambda item, params, parsed: (0, str(parsed[item])),
+    }
+
+    assert checks['foo'].check_many('<<<foo>>>\na 1').results == {'a': (0, '1')}
+    assert parse_function.call_count == 1